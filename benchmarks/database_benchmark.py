@@ -0,0 +1,177 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+"""
+Database throughput benchmark under concurrent checker and handler threads, three implementations of hot-path queries:
+connection per query with f-string SQL (old implementation), SQLite pooling (Database per-thread connections, WAL,
+cached parameterized statements; every read runs SQL) and snapshot (Database reads users and networks from in-memory
+snapshot, no SQL on hot path).
+
+Usage: python benchmarks/database_benchmark.py [--checkers 6] [--handlers 4] [--duration 5] [--users 1000]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NETWORKS = ["DaoPush", "Evadav", "PropellerAds", "ZeroPark", "MGID", "Push.house"]
+
+
+class ConnectionPerQueryDatabase:
+    """
+    Old implementation of hot-path queries: new connection and f-string SQL for every query.
+    """
+
+    def __init__(self, database_name):
+        self._database_name = database_name
+        self._lock = threading.Lock()
+
+    def get_users(self):
+        with sqlite3.connect(self._database_name) as connection:
+            return True, connection.execute("SELECT * from users").fetchall()
+
+    def is_authorized(self, chat_id):
+        with sqlite3.connect(self._database_name) as connection:
+            return True, len(connection.execute(f"SELECT * from users WHERE chat_id={chat_id}").fetchall()) > 0
+
+    def get_notification_levels(self, network):
+        with self._lock:
+            with sqlite3.connect(self._database_name) as connection:
+                levels = connection.execute(f"SELECT * from networks WHERE name='{network}'").fetchone()
+                return True, {"info": levels[1], "warning": levels[2], "critical": levels[3]}
+
+    def get_network_status(self, network):
+        with self._lock:
+            with sqlite3.connect(self._database_name) as connection:
+                return connection.execute(f"SELECT * from networks WHERE name='{network}'").fetchone()[4]
+
+
+class PooledQueriesDatabase:
+    """
+    Hot-path queries on Database per-thread connections with parameterized statements, bypassing snapshot.
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    def get_users(self):
+        return True, self._database._connection().execute(
+            "SELECT chat_id, login, first_name, last_name from users"
+        ).fetchall()
+
+    def is_authorized(self, chat_id):
+        return True, self._database._connection().execute(
+            "SELECT 1 from users WHERE chat_id=? LIMIT 1", (chat_id,)
+        ).fetchone() is not None
+
+    def get_notification_levels(self, network):
+        levels = self._database._connection().execute(
+            "SELECT info_level, warning_level, critical_level from networks WHERE name=?", (network,)
+        ).fetchone()
+        return True, {"info": levels[0], "warning": levels[1], "critical": levels[2]}
+
+    def get_network_status(self, network):
+        return self._database._connection().execute(
+            "SELECT status from networks WHERE name=?", (network,)
+        ).fetchone()[0]
+
+
+def create_database(users_number):
+    connection = sqlite3.connect("info.sqlite3")
+
+    connection.execute("CREATE table users (chat_id integer, login text, first_name text, last_name text)")
+    connection.execute("CREATE table networks (name text, info_level real, warning_level real, critical_level real, "
+                       "status integer)")
+    connection.executemany("INSERT INTO users VALUES (?, ?, ?, ?)",
+                           [(chat_id, f"user{chat_id}", "First", "Last") for chat_id in range(users_number)])
+    connection.executemany("INSERT INTO networks VALUES (?, 100, 50, 10, 'enabled')",
+                           [(network,) for network in NETWORKS])
+
+    connection.commit()
+    connection.close()
+
+
+def run(database, checkers, handlers, duration, users_number):
+    """
+    Run checker threads (network status + notification levels, as check_balance does) and handler threads
+    (is_authorized for every update, get_users for every notification) for given duration.
+
+    :return: number of queries per second
+    :rtype: float
+    """
+
+    counters = [0] * (checkers + handlers)
+    stop = threading.Event()
+
+    def checker(number):
+        while not stop.is_set():
+            network = NETWORKS[counters[number] % len(NETWORKS)]
+            database.get_network_status(network)
+            database.get_notification_levels(network)
+            counters[number] += 2
+
+    def handler(number):
+        while not stop.is_set():
+            database.is_authorized(counters[number] % users_number)
+            counters[number] += 1
+
+            if counters[number] % 50 == 0:
+                database.get_users()
+                counters[number] += 1
+
+    threads = [threading.Thread(target=checker, args=(number,)) for number in range(checkers)]
+    threads += [threading.Thread(target=handler, args=(number,)) for number in range(checkers, checkers + handlers)]
+
+    for thread in threads:
+        thread.start()
+
+    time.sleep(duration)
+    stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    return sum(counters) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--checkers", type=int, default=6)
+    parser.add_argument("--handlers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        create_database(args.users)
+
+        from services.database_cursor import Database
+
+        database = Database()
+        results = [
+            ("connection per query", run(ConnectionPerQueryDatabase("info.sqlite3"), args.checkers, args.handlers,
+                                         args.duration, args.users)),
+            ("sqlite pooling", run(PooledQueriesDatabase(database), args.checkers, args.handlers, args.duration,
+                                   args.users)),
+            ("snapshot", run(database, args.checkers, args.handlers, args.duration, args.users)),
+        ]
+
+        print(f"checkers: {args.checkers}, handlers: {args.handlers}, users: {args.users}")
+        for name, queries_per_second in results:
+            print(f"{name:22} {queries_per_second:10.0f} queries/s ({queries_per_second / results[0][1]:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+"""
+HTML extraction benchmark over saved pages (benchmarks/fixtures): BeautifulSoup with CSS selectors (old
+implementation, skipped if beautifulsoup4 isn't installed) against HtmlExtractor backends (precompiled lxml XPath and
+regex). Reports CPU time and peak traced memory per parse.
+
+Note: tracemalloc traces only Python allocations, memory allocated by libxml2 inside lxml isn't included.
+
+Usage: python benchmarks/html_extraction_benchmark.py [--iterations 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ts_clients import daopush_client, pushhouse_client
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def soup_dao_balance(page):
+    soup = BeautifulSoup(page, "lxml")
+    return str(
+        soup.select(
+            "#topnav > div.topbar-main > div > div.menu-extras > div.top-nav.pull-right.hidden-xs > ul > "
+            "li:nth-child(3) > a"
+        )[0]
+    ).split("$")[1].split("<")[0]
+
+
+def soup_dao_csrf(page):
+    soup = BeautifulSoup(page, "lxml")
+    return str(soup.select("#login-form > input[type=hidden]")[0]).split('value="')[1].split('"')[0]
+
+
+def soup_pushhouse_balance(page):
+    soup = BeautifulSoup(page, "lxml")
+    selector = "body > div.wrapper100.headerblock > div > div > div.col.flexible > div > div.amountBlock > span"
+
+    return str(soup.select(selector)[0]).split("$")[1].split("<")[0].strip()
+
+
+def soup_pushhouse_sitekey(page):
+    soup = BeautifulSoup(page, "lxml")
+    return str(soup.select("#mainBlock > div > form > div:nth-child(4) > div")[0]).split('"')[3]
+
+
+# fixture, old implementation, extractor, value normalization (to compare results of all implementations)
+CASES = [
+    ("daopush_statistic.html", soup_dao_balance, daopush_client._BALANCE_EXTRACTOR,
+     lambda value: float(value.replace("$", ""))),
+    ("daopush_login.html", soup_dao_csrf, daopush_client._CSRF_EXTRACTOR, str),
+    ("pushhouse_dashboard.html", soup_pushhouse_balance, pushhouse_client._BALANCE_EXTRACTOR,
+     lambda value: float(value.replace("$", "").split("<")[0].strip("+ "))),
+    ("pushhouse_login.html", soup_pushhouse_sitekey, pushhouse_client._SITEKEY_EXTRACTOR, str),
+]
+
+
+def measure(parse, page, iterations):
+    """
+    Measure parse function.
+
+    :return: result, CPU time per parse (ms) and peak traced memory per parse (KiB)
+    :rtype: Tuple[Any, float, float]
+    """
+
+    start = time.process_time()
+    for _ in range(iterations):
+        result = parse(page)
+    cpu_time = (time.process_time() - start) / iterations * 1000
+
+    tracemalloc.start()
+    parse(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, cpu_time, peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    if BeautifulSoup is None:
+        print("beautifulsoup4 isn't installed, old implementation is skipped.")
+
+    print(f"{'page':<26}{'implementation':<16}{'size, KiB':>10}{'CPU, ms':>10}{'peak, KiB':>11}")
+
+    for fixture, soup_parse, extractor, normalize in CASES:
+        with open(os.path.join(FIXTURES_DIRECTORY, fixture), encoding="utf-8") as fixture_file:
+            page = fixture_file.read()
+
+        implementations = [("xpath", extractor.extract_xpath), ("regex", extractor.extract_regex)]
+        if BeautifulSoup is not None:
+            implementations.insert(0, ("beautifulsoup", soup_parse))
+
+        results = set()
+
+        for name, parse in implementations:
+            result, cpu_time, peak = measure(parse, page, args.iterations)
+            results.add(normalize(result))
+            print(f"{fixture:<26}{name:<16}{len(page) / 1024:>10.1f}{cpu_time:>10.3f}{peak:>11.1f}")
+
+        if len(results) != 1:
+            print(f"{fixture}: implementations returned different values: {results}")
+
+
+if __name__ == "__main__":
+    main()
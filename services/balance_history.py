@@ -0,0 +1,133 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import logging
+import os
+import threading
+import time
+
+from services.database_cursor import Database
+from services.helpers.singleton import Singleton
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class BalanceHistory(metaclass=Singleton):
+    """
+    Balances time-series store. Samples are buffered and written in batches; every sample is added to hourly and daily
+    rollups on write, old raw samples and hourly rollups are pruned (daily rollups are kept forever).
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger("WorkingLoop.BalanceHistory")
+        self._database = Database()
+
+        self._batch_size = int(os.getenv("HISTORY_BATCH_SIZE", 500))
+        self._samples_retention = float(os.getenv("HISTORY_SAMPLES_RETENTION", 7)) * DAY  # days
+        self._hourly_retention = float(os.getenv("HISTORY_HOURLY_RETENTION", 90)) * DAY  # days
+        self._hourly_max_period = float(os.getenv("HISTORY_HOURLY_MAX_PERIOD", 3)) * DAY  # days
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_prune_time = 0
+
+        self._logger.info("Balance history initialized.")
+
+    def add_sample(self, network, account, balance, timestamp=None):
+        """
+        Add balance sample to buffer (buffer is flushed when it is full).
+
+        :param network: network fullname
+        :type network: str
+
+        :param account: account name
+        :type account: str
+
+        :param balance: balance
+        :type balance: float
+
+        :param timestamp: sample unix timestamp (None - now)
+        :type timestamp: Union[None, int]
+
+        :return: None
+        """
+
+        sample = (network, account, int(timestamp if timestamp is not None else time.time()), float(balance))
+
+        with self._lock:
+            self._buffer.append(sample)
+            buffer_is_full = len(self._buffer) >= self._batch_size
+
+        if buffer_is_full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered samples in one transaction and prune old data (at most once per hour).
+
+        :return: None
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                samples, self._buffer = self._buffer, []
+
+            if samples:
+                success, message = self._database.add_balance_samples(samples, [HOUR, DAY])
+
+                if not success:
+                    self._logger.error(f"Can't save {len(samples)} balance samples: {message}")
+
+                    with self._lock:
+                        self._buffer = samples + self._buffer
+                    return
+
+            now = time.time()
+
+            if now - self._last_prune_time >= HOUR:
+                success, message = self._database.prune_balance_history(
+                    int(now - self._samples_retention), {HOUR: int(now - self._hourly_retention)}
+                )
+
+                if success:
+                    self._last_prune_time = now
+                else:
+                    self._logger.error(f"Can't prune balance history: {message}")
+
+    def get_history(self, network, period):
+        """
+        Get balance history of all accounts of network from rollups: hourly for short periods, else daily.
+
+        :param network: network fullname
+        :type network: str
+
+        :param period: period in seconds
+        :type period: float
+
+        :return: status (True if success, else False), resolution in seconds and rollups grouped by account
+        :rtype: Tuple[bool, int, Union[Dict[str, List[Dict[str, Union[int, float]]]], Exception]]
+        """
+
+        self.flush()
+
+        resolution = HOUR if period <= self._hourly_max_period else DAY
+        since = int(time.time() - period)
+        since -= since % resolution
+
+        success, rollups = self._database.get_balance_rollups(network, resolution, since)
+
+        if not success:
+            return False, resolution, rollups
+
+        history = {}
+        for rollup in rollups:
+            history.setdefault(rollup.pop("account"), []).append(rollup)
+
+        return True, resolution, history
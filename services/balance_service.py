@@ -6,12 +6,20 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
+import asyncio
 import logging
 import os
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from services.balance_history import BalanceHistory
+from services.database_cursor import Database
 from services.telegram.sender import Sender
+from services.helpers import async_requests_manager
+from services.helpers.balance_cache import BalanceCache
+from services.helpers.polling_scheduler import PollingScheduler
 from services.helpers.singleton import Singleton
+from services.ts_clients.async_ts_client import make_async_client
 from services.ts_clients.clients import *
 
 
@@ -19,19 +27,80 @@ class BalanceService(metaclass=Singleton):
     def __init__(self, telegram_access_token):
         self._logger = logging.getLogger("WorkingLoop.BalanceService")
         self._sender = Sender(telegram_access_token)
+        self._database = Database()
+        self._balance_history = BalanceHistory()
 
-        self._clients = [
-            DaoPushClient(telegram_access_token),
-            EvadavClient(telegram_access_token),
-            PropellerClient(telegram_access_token),
-            ZeroParkClient(telegram_access_token),
-            MgidClient(telegram_access_token),
-            PushHouseClient(telegram_access_token),
-        ]
+        self._clients = self._create_clients(telegram_access_token)
+        self._network_clients = {}
+        for client in self._clients:
+            self._network_clients.setdefault(client.network_fullname, []).append(client)
+        self._clients_by_key = {(client.network_fullname, client.account_name): client for client in self._clients}
 
         self._balances_checking_interval = float(os.getenv("BALANCES_CHECKING_INTERVAL", 900))  # seconds
+        self._client_check_timeout = float(os.getenv("CLIENT_CHECK_TIMEOUT", 300))  # seconds
+        self._balance_cache = BalanceCache(ttl=float(os.getenv("BALANCE_CACHE_TTL", 60)))  # seconds
+
+        self._network_concurrency = {
+            network: int(os.getenv(f"{client_class.__name__.replace('Client', '').upper()}_CONCURRENCY",
+                                   os.getenv("NETWORK_CONCURRENCY", 2)))
+            for network, client_class in NETWORK_CLIENTS.items()
+        }
+        # threads mode runs one check task per network (accounts are fetched inside it up to network cap), so pool
+        # defaults to number of networks; asyncio mode checks accounts one by one, so its limit defaults to the sum of
+        # network caps. Either way capped networks never block others.
+        self._checking_workers = int(os.getenv("BALANCES_CHECKING_WORKERS", len(NETWORK_CLIENTS)))
+        self._async_checking_workers = int(os.getenv("BALANCES_CHECKING_WORKERS",
+                                                     sum(self._network_concurrency.values())))
+
+        self._executor = ThreadPoolExecutor(max_workers=self._checking_workers,
+                                            thread_name_prefix="BalancesCheckingWorker")
+        self._checks_start_time = {}
+
+        # adaptive polling: every account has its own next-due time
+        self._scheduler = PollingScheduler()
+        self._min_polling_interval = float(os.getenv("MIN_POLLING_INTERVAL", 60))  # seconds
+        self._max_polling_interval = float(os.getenv("MAX_POLLING_INTERVAL", 3600))  # seconds
+        self._healthy_polling_factor = float(os.getenv("HEALTHY_POLLING_FACTOR", 3))
+        self._web_polling_factor = float(os.getenv("WEB_POLLING_FACTOR", 2))
+        self._checks_before_critical = int(os.getenv("CHECKS_BEFORE_CRITICAL", 4))
+        self._polling_batch_window = float(os.getenv("POLLING_BATCH_WINDOW", 30))  # seconds
+        self._polling_failures = {}
+
+        self._logger.info(f"Balance service was successfully initialized ({len(self._clients)} accounts).")
+
+    def _create_clients(self, telegram_access_token):
+        """
+        Create clients for all accounts from database. If network has no accounts in database, create client for
+        default account (credentials from environment). Clients without credentials are skipped.
+
+        :param telegram_access_token: telegram access token
+        :type telegram_access_token: str
+
+        :return: clients list
+        :rtype: List[TrafficSourceClient]
+        """
+
+        clients = []
+
+        for network, client_class in NETWORK_CLIENTS.items():
+            success, accounts = self._database.get_accounts(network)
 
-        self._logger.info("Balance service was successfully initialized.")
+            if not success:
+                self._logger.error(f"Database error occurred while trying to get {network} accounts: {accounts}")
+                accounts = []
+
+            if accounts:
+                network_clients = [client_class(telegram_access_token, account) for account in accounts]
+            else:
+                network_clients = [client_class(telegram_access_token)]
+
+            for client in network_clients:
+                if client.has_credentials():
+                    clients.append(client)
+                else:
+                    self._logger.warning(f"Can't find credentials for {client.display_name}, skip it.")
+
+        return clients
 
     def set_notifications_interval(self, chat_id, interval):
         """
@@ -52,20 +121,266 @@ class BalanceService(metaclass=Singleton):
         self._sender.send_message(chat_id, "Success.")
         self._logger.info(f"Change notifications interval to {interval}")
 
-    def get_balance(self, network):
-        for client in self._clients:
-            if client.network_alias == network or client.network_fullname == network:
-                return client.get_balance()
+    def _get_network_balances(self, network, clients, max_age=None):
+        """
+        Get balances of given accounts of network: fresh cached balances are reused, the rest are fetched using batch
+        path (shared with concurrent callers).
+
+        :param network: network fullname
+        :type network: str
+
+        :param clients: network clients
+        :type clients: List[TrafficSourceClient]
+
+        :param max_age: max age of cached balances in seconds (None - cache ttl, 0 - always fetch)
+        :type max_age: Union[None, float]
+
+        :return: balances of accounts
+        :rtype: Dict[TrafficSourceClient, Union[None, float]]
+        """
+
+        clients_by_key = {(client.network_fullname, client.account_name): client for client in clients}
+
+        def load(keys):
+            balances = NETWORK_CLIENTS[network].get_balances([clients_by_key[key] for key in keys],
+                                                             self._network_concurrency[network])
+            return {key: balances.get(clients_by_key[key]) for key in keys}
+
+        balances = self._balance_cache.fetch(list(clients_by_key), load, max_age)
+
+        return {client: balances.get(key) for key, client in clients_by_key.items()}
+
+    def get_balance(self, network, max_staleness=None):
+        """
+        Get balances of all accounts for given network.
+
+        :param network: network alias or fullname
+        :type network: str
+
+        :param max_staleness: max age of cached balances in seconds (None - cache ttl)
+        :type max_staleness: Union[None, float]
+
+        :return: list of clients and their balances
+        :rtype: List[Tuple[TrafficSourceClient, Union[None, float]]]
+        """
+
+        for network_fullname, clients in self._network_clients.items():
+            if clients[0].network_alias == network or network_fullname == network:
+                balances = self._get_network_balances(network_fullname, clients, max_staleness)
+                return [(client, balances.get(client)) for client in clients]
+
+        return []
+
+    def _check_network(self, network, clients):
+        """
+        Check balances of given accounts of network - target for worker pool.
+
+        :param network: network fullname
+        :type network: str
+
+        :param clients: network clients
+        :type clients: List[TrafficSourceClient]
+
+        :return: balances of accounts or None if network is disabled
+        :rtype: Union[None, Dict[TrafficSourceClient, Union[None, float]]]
+        """
+
+        self._checks_start_time[network] = time.monotonic()
+
+        try:
+            if not clients[0].is_enabled():
+                return
+
+            balances = self._get_network_balances(network, clients, max_age=0)
+
+            for client in clients:
+                try:
+                    client.handle_balance(balances.get(client))
+                except Exception as error:
+                    self._logger.error(f"Error occurred while handling {client.display_name} balance: {error!r}")
+
+            return balances
+        finally:
+            self._checks_start_time.pop(network, None)
+
+    def _polling_interval(self, client, balance):
+        """
+        Choose interval until next check of account: healthy accounts are polled less often, accounts near notification
+        borders or burning fast - more often. Failed checks back off exponentially, web-interface accounts (expensive
+        logins with captcha) are polled less often.
+
+        :param client: client
+        :type client: TrafficSourceClient
+
+        :param balance: checked balance (None if check failed)
+        :type balance: Union[None, float]
+
+        :return: interval in seconds
+        :rtype: float
+        """
+
+        key = (client.network_fullname, client.account_name)
+        interval = self._balances_checking_interval
+
+        if balance is None:
+            failures = self._polling_failures[key] = self._polling_failures.get(key, 0) + 1
+            interval *= 2 ** min(failures - 1, 10)
+        else:
+            self._polling_failures.pop(key, None)
+            success, notification_levels = self._database.get_notification_levels(client.network_fullname)
+
+            if success:
+                if balance > max(notification_levels.values()):
+                    interval *= self._healthy_polling_factor
+                elif balance <= notification_levels["warning"]:
+                    interval /= self._healthy_polling_factor
+
+            # check account several times before it reaches critical level
+            if client.hours_until_critical:
+                interval = min(interval, client.hours_until_critical * 3600 / self._checks_before_critical)
+
+        if client.interface == "web":
+            interval *= self._web_polling_factor
+
+        return min(max(interval, self._min_polling_interval), self._max_polling_interval)
+
+    def _reschedule(self, network, clients, balances):
+        """
+        Schedule next checks of given accounts after network check.
+
+        :param network: network fullname
+        :type network: str
+
+        :param clients: checked clients
+        :type clients: List[TrafficSourceClient]
+
+        :param balances: check result (None if network is disabled)
+        :type balances: Union[None, Dict[TrafficSourceClient, Union[None, float]]]
+
+        :return: None
+        """
+
+        now = time.monotonic()
+
+        for client in clients:
+            if balances is None:
+                interval = self._balances_checking_interval
+            else:
+                interval = self._polling_interval(client, balances.get(client))
+
+            self._scheduler.schedule((network, client.account_name), now + interval)
+            self._logger.debug(f"Next {client.display_name} check in {round(interval)} seconds.")
 
     def check_balances(self):
         """
-        Checks balances and send notifications in infinite loop.
+        Checks balances and send notifications in infinite loop. Accounts are checked when they are due (due accounts
+        of one network are checked in one batch), every network has at most one running check. Network check is
+        considered stalled if it runs longer than client check timeout: it is reported and network accounts wait until
+        it is finished.
 
         :return: None
         """
 
+        now = time.monotonic()
+        for key in self._clients_by_key:
+            self._scheduler.schedule(key, now)
+
+        running_checks = {}  # future -> (network, clients)
+        stalled_checks = set()
+
         while True:
-            for client in self._clients:
-                client.check_balance()
+            if running_checks:
+                done, _ = wait(running_checks, timeout=1, return_when=FIRST_COMPLETED)
+            else:
+                next_due_time = self._scheduler.next_due_time()
+                time.sleep(min(max(next_due_time - time.monotonic(), 0), 1) if next_due_time is not None else 1)
+                done = set()
+
+            for future in done:
+                network, clients = running_checks.pop(future)
+                stalled_checks.discard(future)
+
+                error = future.exception()
+                if error:
+                    self._logger.error(f"Error occurred while checking {network} balances: {error!r}")
+
+                self._reschedule(network, clients, None if error else future.result())
+
+            if done:
+                self._balance_history.flush()
+
+            now = time.monotonic()
+            busy_networks = {network for network, _ in running_checks.values()}
+
+            for future, (network, _) in running_checks.items():
+                start_time = self._checks_start_time.get(network)
+
+                if future not in stalled_checks and start_time is not None and \
+                        now - start_time > self._client_check_timeout:
+                    stalled_checks.add(future)
+                    self._logger.error(f"Balance check for {network} stalled "
+                                       f"(not finished in {self._client_check_timeout} seconds).")
+
+            # accounts which are due soon are added to batch of their network
+            due_clients = {}
+            for key in self._scheduler.pop_due(now + self._polling_batch_window):
+                due_clients.setdefault(key[0], []).append(self._clients_by_key[key])
+
+            for network, clients in due_clients.items():
+                if network in busy_networks:
+                    for client in clients:
+                        self._scheduler.schedule((network, client.account_name), now + 1)
+                    continue
+
+                running_checks[self._executor.submit(self._check_network, network, clients)] = (network, clients)
+
+    async def _check_balance_async(self, client, semaphore, network_semaphore):
+        """
+        Check balance of given async client with client check timeout.
+
+        :param client: async client
+        :type client: AsyncTrafficSourceClient
+
+        :param semaphore: semaphore limiting number of simultaneous checks
+        :type semaphore: asyncio.Semaphore
+
+        :param network_semaphore: semaphore limiting number of simultaneous checks for client network
+        :type network_semaphore: asyncio.Semaphore
+
+        :return: None
+        """
+
+        async with network_semaphore, semaphore:
+            try:
+                balance = await asyncio.wait_for(client.check_balance(), timeout=self._client_check_timeout)
+                self._balance_cache.put((client.network_fullname, client.account_name), balance)
+            except asyncio.TimeoutError:
+                self._logger.error(f"Balance check for {client.display_name} stalled "
+                                   f"(not finished in {self._client_check_timeout} seconds).")
+            except Exception as error:
+                self._logger.error(f"Error occurred while checking {client.display_name} balance: {error!r}")
+
+    async def check_balances_async(self):
+        """
+        Checks balances and send notifications in infinite loop (asyncio mode). Accounts are fetched one by one:
+        bulk (agency) endpoints are used in threads mode only.
+
+        :return: None
+        """
+
+        clients = [make_async_client(client) for client in self._clients]
+        semaphore = asyncio.Semaphore(self._async_checking_workers)
+        network_semaphores = {
+            network: asyncio.Semaphore(concurrency) for network, concurrency in self._network_concurrency.items()
+        }
 
-            time.sleep(self._balances_checking_interval)
+        try:
+            while True:
+                await asyncio.gather(*(
+                    self._check_balance_async(client, semaphore, network_semaphores[client.network_fullname])
+                    for client in clients
+                ))
+                await asyncio.get_running_loop().run_in_executor(None, self._balance_history.flush)
+                await asyncio.sleep(self._balances_checking_interval)
+        finally:
+            await async_requests_manager.close_shared_session()
@@ -10,16 +10,25 @@ import logging
 import os
 import sqlite3
 import threading
+import time
 
+from services.database_migrations import migrate
+from services.helpers import metrics
 from services.helpers.singleton import Singleton
 
 
+_QUERY_DURATION = metrics.histogram("database_query_duration_seconds", "Duration of database methods.", ("method",))
+_ERRORS = metrics.counter("database_errors", "Database methods failed with error.", ("method",))
+
+
 def catch_database_error(method):
     """
-    Catch sqlite3 errors.
+    Catch sqlite3 errors and record method duration.
     """
 
     def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+
         try:
             return method(*args, **kwargs)
         except (
@@ -29,25 +38,39 @@ def catch_database_error(method):
                 sqlite3.Error,
                 Exception,
         ) as database_error:
+            _ERRORS.inc(method=method.__name__)
             return False, database_error
+        finally:
+            _QUERY_DURATION.observe(time.perf_counter() - start_time, method=method.__name__)
 
     return wrapper
 
 
 class Database(metaclass=Singleton):
     """
-    Singleton database client.
+    Singleton database client. Every thread reuses its own connection (WAL mode, cached prepared statements).
+    Users and networks are read from in-memory snapshot which is invalidated by every mutation (and reloaded after
+    snapshot ttl to pick up manual changes of database).
     """
 
+    _level_columns = {"info": "info_level", "warning": "warning_level", "critical": "critical_level"}
+
     def __init__(self):
         self._logger = logging.getLogger("WorkingLoop.Database")
         self._database_name = "info.sqlite3"
+        self._cached_statements = int(os.getenv("DATABASE_CACHED_STATEMENTS", 128))
+        self._busy_timeout = float(os.getenv("DATABASE_BUSY_TIMEOUT", 30))  # seconds
+        self._local = threading.local()
+
+        self._snapshot = None
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_ttl = float(os.getenv("DATABASE_SNAPSHOT_TTL", 300))  # seconds
 
         self._logger.info(f"Database name: {self._database_name}")
 
         if not os.path.exists(self._database_name):
             self._logger.warning("Database doesn't exist, start to creating new one...")
-            success, message = self._create_database()
+            success, message = self._migrate()
 
             if success:
                 self._logger.info("Database created. Please fill users and networks and then restart the program.")
@@ -56,29 +79,218 @@ class Database(metaclass=Singleton):
                 self._logger.critical(f"Can't create database. Error: {message}")
                 exit(-1)
 
-        self._lock = threading.Lock()
+        success, message = self._migrate()
+        if not success:
+            self._logger.critical(f"Can't migrate database. Error: {message}")
+            exit(-1)
+
         self._logger.info("Database initialized.")
 
+    def _connection(self):
+        """
+        Return connection of current thread (create it on first call).
+
+        :return: connection
+        :rtype: sqlite3.Connection
+        """
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self._database_name, timeout=self._busy_timeout,
+                                         cached_statements=self._cached_statements)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+
+            self._local.connection = connection
+
+        return connection
+
+    def _load_snapshot(self):
+        """
+        Read users and networks from database.
+
+        :return: snapshot
+        :rtype: Dict[str, Any]
+        """
+
+        connection = self._connection()
+
+        users = [
+            {"chat_id": query[0], "login": query[1], "first_name": query[2], "last_name": query[3]}
+            for query in connection.execute("SELECT chat_id, login, first_name, last_name from users").fetchall()
+        ]
+        networks = {
+            query[0]: {"info": query[1], "warning": query[2], "critical": query[3], "status": query[4]}
+            for query in connection.execute(
+                "SELECT name, info_level, warning_level, critical_level, status from networks"
+            ).fetchall()
+        }
+
+        return {
+            "users": users,
+            "chat_ids": frozenset(user["chat_id"] for user in users),
+            "networks": networks,
+            "time": time.monotonic(),
+        }
+
+    def _get_snapshot(self):
+        """
+        Return current snapshot (reload it if it was invalidated or expired).
+
+        :return: snapshot
+        :rtype: Dict[str, Any]
+        """
+
+        snapshot = self._snapshot
+
+        if snapshot is None or time.monotonic() - snapshot["time"] > self._snapshot_ttl:
+            with self._snapshot_lock:
+                snapshot = self._snapshot
+
+                if snapshot is None or time.monotonic() - snapshot["time"] > self._snapshot_ttl:
+                    snapshot = self._snapshot = self._load_snapshot()
+
+        return snapshot
+
+    def _invalidate_snapshot(self):
+        """
+        Drop snapshot after mutation, next read reloads it.
+
+        :return: None
+        """
+
+        with self._snapshot_lock:
+            self._snapshot = None
+
+    @catch_database_error
+    def _migrate(self):
+        """
+        Create database (if not exists) and upgrade its schema to the latest version.
+
+        :return: status (True if success, else False) and schema version
+        :rtype: Tuple[Union[bool, int]]
+        """
+
+        return True, migrate(self._connection(), self._logger)
+
+    @catch_database_error
+    def get_accounts(self, network):
+        """
+        Select all accounts for given network.
+
+        :param network: network
+        :type network: str
+
+        :return: status (True if success, else False) and accounts list
+        :rtype: Tuple[Union[bool, List[Dict[str, str]]]]
+        """
+
+        accounts_query = self._connection().execute(
+            "SELECT name, access_token, client_id, login, password from accounts WHERE network=?", (network,)
+        )
+
+        accounts_list = [
+            {"name": query[0], "access_token": query[1], "client_id": query[2], "login": query[3],
+             "password": query[4]}
+            for query in accounts_query.fetchall()
+        ]
+
+        return True, accounts_list
+
     @catch_database_error
-    def _create_database(self):
+    def add_balance_samples(self, samples, resolutions):
         """
-        Create database and all required tables.
+        Append balance samples and add them to rollups of given resolutions (in one transaction).
+
+        :param samples: samples (network, account, timestamp, balance)
+        :type samples: List[Tuple[str, str, int, float]]
+
+        :param resolutions: rollups resolutions in seconds
+        :type resolutions: List[int]
 
         :return: status (True if success, else False) and message
         :rtype: Tuple[Union[bool, str]]
         """
 
-        connection = sqlite3.connect(self._database_name)
-        cursor = connection.cursor()
+        with self._connection() as connection:
+            connection.executemany("INSERT INTO balance_samples (network, account, timestamp, balance) "
+                                   "VALUES (?, ?, ?, ?)", samples)
+
+            for resolution in resolutions:
+                connection.executemany(
+                    "INSERT INTO balance_rollups (network, resolution, account, bucket, samples, total, minimum, "
+                    "maximum, last, last_timestamp) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (network, resolution, account, bucket) DO UPDATE SET "
+                    "samples = samples + 1, total = total + excluded.total, "
+                    "minimum = MIN(minimum, excluded.minimum), maximum = MAX(maximum, excluded.maximum), "
+                    "last = CASE WHEN excluded.last_timestamp >= last_timestamp THEN excluded.last ELSE last END, "
+                    "last_timestamp = MAX(last_timestamp, excluded.last_timestamp)",
+                    [
+                        (network, resolution, account, timestamp - timestamp % resolution, balance, balance, balance,
+                         balance, timestamp)
+                        for network, account, timestamp, balance in samples
+                    ],
+                )
 
-        cursor.execute("CREATE table users (chat_id integer, login text, first_name text, last_name text)")
-        cursor.execute("CREATE table networks (name text, info_level real, warning_level real, critical_level real, "
-                       "status integer)")
+        return True, "OK"
 
-        connection.commit()
+    @catch_database_error
+    def prune_balance_history(self, samples_before, rollups_before):
+        """
+        Delete raw samples and rollups older than given timestamps (data is already aggregated to coarser rollups).
+
+        :param samples_before: raw samples older than this timestamp are deleted
+        :type samples_before: int
+
+        :param rollups_before: resolution -> rollups older than this timestamp are deleted
+        :type rollups_before: Dict[int, int]
+
+        :return: status (True if success, else False) and message
+        :rtype: Tuple[Union[bool, str]]
+        """
+
+        with self._connection() as connection:
+            connection.execute("DELETE FROM balance_samples WHERE timestamp < ?", (samples_before,))
+
+            for resolution, before in rollups_before.items():
+                connection.execute("DELETE FROM balance_rollups WHERE resolution = ? AND bucket < ?",
+                                   (resolution, before))
 
         return True, "OK"
 
+    @catch_database_error
+    def get_balance_rollups(self, network, resolution, since):
+        """
+        Select rollups of given resolution for all accounts of network.
+
+        :param network: network
+        :type network: str
+
+        :param resolution: rollups resolution in seconds
+        :type resolution: int
+
+        :param since: min bucket timestamp
+        :type since: int
+
+        :return: status (True if success, else False) and rollups list (ordered by account and bucket)
+        :rtype: Tuple[Union[bool, List[Dict[str, Union[str, int, float]]]]]
+        """
+
+        rollups_query = self._connection().execute(
+            "SELECT account, bucket, samples, total, minimum, maximum, last from balance_rollups "
+            "WHERE network = ? AND resolution = ? AND bucket >= ? ORDER BY account, bucket",
+            (network, resolution, since),
+        )
+
+        rollups_list = [
+            {"account": query[0], "bucket": query[1], "samples": query[2], "average": query[3] / query[2],
+             "minimum": query[4], "maximum": query[5], "last": query[6]}
+            for query in rollups_query.fetchall()
+        ]
+
+        return True, rollups_list
+
     @catch_database_error
     def get_users(self):
         """
@@ -88,15 +300,7 @@ class Database(metaclass=Singleton):
         :rtype: Tuple[Union[bool, List[Dict[str, Union[int, str]]]]]
         """
 
-        with sqlite3.connect(self._database_name) as connection:
-            users_query = connection.execute("SELECT * from users")
-
-            users_list = [
-                {"chat_id": query[0], "login": query[1], "first_name": query[2], "last_name": query[3]}
-                for query in users_query.fetchall()
-            ]
-
-        return True, users_list
+        return True, self._get_snapshot()["users"]
 
     @catch_database_error
     def is_authorized(self, chat_id):
@@ -110,14 +314,7 @@ class Database(metaclass=Singleton):
         :rtype: Tuple[bool]
         """
 
-        with sqlite3.connect(self._database_name) as connection:
-            users_query = connection.execute(f"SELECT * from users WHERE chat_id={chat_id}")
-
-            if len(users_query.fetchall()) > 0:
-                return True, True
-            return True, False
-
-        return True, users_list
+        return True, chat_id in self._get_snapshot()["chat_ids"]
 
     @catch_database_error
     def get_notification_levels(self, network):
@@ -131,14 +328,11 @@ class Database(metaclass=Singleton):
         :rtype: Tuple[Union[bool, List[Dict[str, float]]]]
         """
 
-        with self._lock:
-            with sqlite3.connect(self._database_name) as connection:
-                notification_levels_query = connection.execute(f"SELECT * from networks WHERE name='{network}'")
-                levels = notification_levels_query.fetchone()
+        levels = self._get_snapshot()["networks"][network]
 
-                notification_levels = {"info": levels[1], "warning": levels[2], "critical": levels[3]}
+        notification_levels = {"info": levels["info"], "warning": levels["warning"], "critical": levels["critical"]}
 
-            return True, notification_levels
+        return True, notification_levels
 
     @catch_database_error
     def set_notification_level_balance(self, network, level, balance):
@@ -158,9 +352,13 @@ class Database(metaclass=Singleton):
         :rtype: Tuple[Union[bool, str]]
         """
 
-        with self._lock:
-            with sqlite3.connect(self._database_name) as connection:
-                connection.execute(f"UPDATE networks SET {level}_level={balance} WHERE name='{network}'")
+        # column name can't be query parameter, so it is taken from fixed set of columns
+        column = self._level_columns[level]
+
+        with self._connection() as connection:
+            connection.execute(f"UPDATE networks SET {column}=? WHERE name=?", (balance, network))
+
+        self._invalidate_snapshot()
 
         return True, "OK"
 
@@ -176,9 +374,10 @@ class Database(metaclass=Singleton):
         :rtype: Tuple[Union[bool, str]]
         """
 
-        with self._lock:
-            with sqlite3.connect(self._database_name) as connection:
-                connection.execute(f"UPDATE networks SET status='{status}' WHERE name='{network}'")
+        with self._connection() as connection:
+            connection.execute("UPDATE networks SET status=? WHERE name=?", (status, network))
+
+        self._invalidate_snapshot()
 
         return True, "OK"
 
@@ -193,8 +392,4 @@ class Database(metaclass=Singleton):
         :return: network status
         """
 
-        with self._lock:
-            with sqlite3.connect(self._database_name) as connection:
-                status_query = connection.execute(f"SELECT * from networks WHERE name='{network}'")
-
-                return status_query.fetchone()[4]
+        return self._get_snapshot()["networks"][network]["status"]
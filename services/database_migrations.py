@@ -0,0 +1,178 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import logging
+from datetime import datetime
+
+
+def _create_initial_tables(connection):
+    """
+    Version 1: users and networks tables (as they were created before migrations).
+    """
+
+    connection.execute("CREATE table IF NOT EXISTS users (chat_id integer, login text, first_name text, "
+                       "last_name text)")
+    connection.execute("CREATE table IF NOT EXISTS networks (name text, info_level real, warning_level real, "
+                       "critical_level real, status integer)")
+
+
+def _create_accounts_table(connection):
+    """
+    Version 2: accounts table (several accounts per network). Credentials which aren't used by network are NULL.
+    """
+
+    connection.execute("CREATE table IF NOT EXISTS accounts (network text, name text, access_token text, "
+                       "client_id text, login text, password text)")
+
+
+def _rebuild_table(connection, table, columns_definition, columns, unique_columns):
+    """
+    Recreate table with new columns definition and unique index, copy rows (rows with NULL in unique columns, which
+    are NOT NULL in new table, and duplicates by unique columns are dropped, first row is kept; numbers of dropped
+    rows are logged).
+
+    :param connection: connection
+    :type connection: sqlite3.Connection
+
+    :param table: table name
+    :type table: str
+
+    :param columns_definition: columns definition for CREATE TABLE (unique columns must be NOT NULL)
+    :type columns_definition: str
+
+    :param columns: copied columns
+    :type columns: str
+
+    :param unique_columns: columns of unique index
+    :type unique_columns: str
+
+    :return: None
+    """
+
+    logger = logging.getLogger("WorkingLoop.Database")
+    not_null_condition = " AND ".join(f"{column.strip()} IS NOT NULL" for column in unique_columns.split(","))
+
+    connection.execute(f"CREATE table {table}_new ({columns_definition})")
+    connection.execute(f"CREATE UNIQUE INDEX {table}_unique ON {table}_new ({unique_columns})")
+    rows_count = connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    not_null_rows_count = connection.execute(
+        f"SELECT COUNT(*) FROM {table} WHERE {not_null_condition}"
+    ).fetchone()[0]
+    copied_rows_count = connection.execute(
+        f"INSERT OR IGNORE INTO {table}_new ({columns}) SELECT {columns} FROM {table} WHERE {not_null_condition} "
+        f"ORDER BY rowid"
+    ).rowcount
+
+    if not_null_rows_count < rows_count:
+        logger.warning(f"{rows_count - not_null_rows_count} rows with NULL in {unique_columns} were dropped from "
+                       f"{table} table during migration.")
+
+    if copied_rows_count < not_null_rows_count:
+        logger.warning(f"{not_null_rows_count - copied_rows_count} duplicate rows (by {unique_columns}) were dropped "
+                       f"from {table} table during migration.")
+
+    connection.execute(f"DROP table {table}")
+    connection.execute(f"ALTER table {table}_new RENAME TO {table}")
+
+
+def _add_primary_keys_and_indexes(connection):
+    """
+    Version 3: primary keys for all tables, unique indexes on users.chat_id, networks.name and
+    (accounts.network, accounts.name).
+    """
+
+    _rebuild_table(connection, "users",
+                   "id integer PRIMARY KEY, chat_id integer NOT NULL, login text, first_name text, last_name text",
+                   "chat_id, login, first_name, last_name", "chat_id")
+    _rebuild_table(connection, "networks",
+                   "id integer PRIMARY KEY, name text NOT NULL, info_level real, warning_level real, "
+                   "critical_level real, status integer",
+                   "name, info_level, warning_level, critical_level, status", "name")
+    _rebuild_table(connection, "accounts",
+                   "id integer PRIMARY KEY, network text NOT NULL, name text NOT NULL, access_token text, "
+                   "client_id text, login text, password text",
+                   "network, name, access_token, client_id, login, password", "network, name")
+
+
+def _create_balance_history_tables(connection):
+    """
+    Version 4: raw balance samples and their hourly/daily rollups (resolution in seconds, bucket is start timestamp).
+    """
+
+    connection.execute("CREATE table balance_samples (network text NOT NULL, account text NOT NULL, "
+                       "timestamp integer NOT NULL, balance real NOT NULL)")
+    connection.execute("CREATE INDEX balance_samples_timestamp ON balance_samples (timestamp)")
+    connection.execute("CREATE table balance_rollups (network text NOT NULL, resolution integer NOT NULL, "
+                       "account text NOT NULL, bucket integer NOT NULL, samples integer NOT NULL, "
+                       "total real NOT NULL, minimum real NOT NULL, maximum real NOT NULL, last real NOT NULL, "
+                       "last_timestamp integer NOT NULL, PRIMARY KEY (network, resolution, account, bucket)) "
+                       "WITHOUT ROWID")
+
+
+# (version, description, migration) - append new migrations to the end, never change applied ones
+MIGRATIONS = [
+    (1, "initial users and networks tables", _create_initial_tables),
+    (2, "accounts table", _create_accounts_table),
+    (3, "primary keys and unique indexes", _add_primary_keys_and_indexes),
+    (4, "balance history tables", _create_balance_history_tables),
+]
+
+
+def schema_version(connection):
+    """
+    Return current schema version (0 for database without schema_version table).
+
+    :param connection: connection
+    :type connection: sqlite3.Connection
+
+    :return: schema version
+    :rtype: int
+    """
+
+    connection.execute("CREATE table IF NOT EXISTS schema_version (version integer PRIMARY KEY, description text, "
+                       "applied_at text)")
+
+    return connection.execute("SELECT MAX(version) from schema_version").fetchone()[0] or 0
+
+
+def migrate(connection, logger):
+    """
+    Upgrade database schema in place: apply all migrations newer than current version, each in its own transaction.
+
+    :param connection: connection
+    :type connection: sqlite3.Connection
+
+    :param logger: logger
+    :type logger: logging.Logger
+
+    :return: schema version after migration
+    :rtype: int
+    """
+
+    current_version = schema_version(connection)
+    connection.commit()
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        connection.execute("BEGIN")
+
+        try:
+            migration(connection)
+            connection.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                               (version, description, datetime.utcnow().isoformat()))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+        current_version = version
+        logger.info(f"Database migrated to version {version} ({description}).")
+
+    return current_version
@@ -0,0 +1,213 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from services.helpers import requests_manager
+
+_shared_session = None
+
+
+class Response:
+    """
+    Fully read response. Provides the part of requests.Response interface used by clients (status_code, text, json).
+    """
+
+    def __init__(self, status_code, text, headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+    def json(self):
+        """
+        Decode response body as json.
+
+        :return: decoded body
+        :rtype: Union[dict, list, str, int, float, None]
+        """
+
+        return json.loads(self.text)
+
+
+def catch_network_errors(method):
+    """
+    Decorator for network errors catching (async version).
+    """
+
+    async def inner(*args, **kwargs):
+        try:
+            return await method(*args, **kwargs)
+        except (aiohttp.ClientError, asyncio.TimeoutError, requests_manager.CircuitOpenError) as network_error:
+            return network_error
+
+    return inner
+
+
+def shared_session():
+    """
+    Return session shared by all async clients of the running event loop. Must be called inside event loop.
+
+    :return: shared session
+    :rtype: aiohttp.ClientSession
+    """
+
+    global _shared_session
+
+    if _shared_session is None or _shared_session.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=requests_manager.POOL_MAXSIZE,
+                                         keepalive_timeout=requests_manager.SESSION_IDLE_TIMEOUT)
+        timeout = aiohttp.ClientTimeout(sock_connect=requests_manager.CONNECT_TIMEOUT,
+                                        sock_read=requests_manager.READ_TIMEOUT)
+        _shared_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    return _shared_session
+
+
+async def close_shared_session():
+    """
+    Close shared session (if exists).
+
+    :return: None
+    """
+
+    global _shared_session
+
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+
+    _shared_session = None
+
+
+async def _send(method, session, url, **kwargs):
+    """
+    Make one request and read response body.
+
+    :param method: http method
+    :type method: str
+
+    :param session: session for response making
+    :type session: aiohttp.ClientSession
+
+    :param url: request url
+    :type url: str
+
+    :return: response
+    :rtype: Response
+    """
+
+    async with session.request(method, url, **kwargs) as response:
+        return Response(response.status, await response.text(), response.headers)
+
+
+async def _request(method, session, url, retries, **kwargs):
+    """
+    Make request with the same policy as threads mode (requests_manager._request): jittered exponential retries and
+    per-host circuit breaker, which is shared with threads mode.
+
+    :param method: http method
+    :type method: str
+
+    :param session: session for response making
+    :type session: aiohttp.ClientSession
+
+    :param url: request url
+    :type url: str
+
+    :param retries: max number of retries
+    :type retries: int
+
+    :return: response (response with gateway error status is returned after last retry)
+    :rtype: Response
+    """
+
+    host = urlsplit(url).netloc
+
+    for attempt in range(retries + 1):
+        if attempt:
+            await asyncio.sleep(random.uniform(0, min(requests_manager.RETRY_BACKOFF * 2 ** attempt,
+                                                      requests_manager.RETRY_BACKOFF_MAX)))
+
+        if not requests_manager._circuit_breaker.allow(host):
+            requests_manager._REQUESTS.inc(host=host, method=method, result="circuit_open")
+            raise requests_manager.CircuitOpenError(f"Circuit breaker for {host} is open.")
+
+        host_healthy = None  # None - request result says nothing about host health
+        start_time = time.perf_counter()
+
+        # every allowed request must finish with record or release, otherwise half-open circuit never closes
+        try:
+            response = await _send(method, session, url, **kwargs)
+
+            requests_manager._REQUEST_DURATION.observe(time.perf_counter() - start_time, host=host, method=method)
+            requests_manager._REQUESTS.inc(host=host, method=method, result=response.status_code)
+            host_healthy = response.status_code not in requests_manager._RETRY_STATUS_CODES
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            requests_manager._REQUEST_DURATION.observe(time.perf_counter() - start_time, host=host, method=method)
+            requests_manager._REQUESTS.inc(host=host, method=method, result="error")
+            host_healthy = False
+
+            if attempt == retries:
+                raise
+            continue
+        except aiohttp.ClientError:
+            requests_manager._REQUEST_DURATION.observe(time.perf_counter() - start_time, host=host, method=method)
+            requests_manager._REQUESTS.inc(host=host, method=method, result="error")
+            raise
+        finally:
+            if host_healthy is None:
+                requests_manager._circuit_breaker.release(host)
+            else:
+                requests_manager._circuit_breaker.record(host, host_healthy)
+
+        if host_healthy or attempt == retries:
+            return response
+
+
+@catch_network_errors
+async def get(session, url, retries=requests_manager.RETRIES, **kwargs):
+    """
+    Make safe async GET response using given session and arguments. Failed request is retried.
+
+    :param session: session for response making
+    :type session: aiohttp.ClientSession
+
+    :param url: request url
+    :type url: str
+
+    :param retries: max number of retries
+    :type retries: int
+
+    :return: response if success, else catch error
+    :rtype: Union[Response, Exception]
+    """
+
+    return await _request("GET", session, url, retries, **kwargs)
+
+
+@catch_network_errors
+async def post(session, url, **kwargs):
+    """
+    Make safe async POST response using given session and arguments. POST isn't idempotent, so it isn't retried.
+
+    :param session: session for response making
+    :type session: aiohttp.ClientSession
+
+    :param url: request url
+    :type url: str
+
+    :return: response if success, else catch error
+    :rtype: Union[Response, Exception]
+    """
+
+    return await _request("POST", session, url, 0, **kwargs)
@@ -0,0 +1,125 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import threading
+import time
+
+
+class _Flight:
+    """
+    Balance fetch in progress. Callers which need the same key wait for its event instead of fetching again.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class BalanceCache:
+    """
+    Thread-safe balances cache with single-flight fetching: concurrent fetches of the same key share one upstream call.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl  # seconds
+
+        self._entries = {}  # key -> (value, fetch time)
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_cacheable(value):
+        """
+        Only real balances are cached, errors (None) are not.
+
+        :param value: fetched value
+        :type value: Union[None, float]
+
+        :return: True if value can be cached, else False
+        :rtype: bool
+        """
+
+        return value is not None
+
+    def put(self, key, value):
+        """
+        Save fetched value.
+
+        :param key: cache key (network, account)
+        :type key: Tuple[str, str]
+
+        :param value: balance
+        :type value: Union[None, float]
+
+        :return: None
+        """
+
+        if self._is_cacheable(value):
+            with self._lock:
+                self._entries[key] = (value, time.monotonic())
+
+    def fetch(self, keys, loader, max_age=None):
+        """
+        Get values for given keys. Values younger than max_age are taken from cache, values which are being fetched
+        by another caller are awaited, the rest are fetched using loader (in one call).
+
+        :param keys: cache keys
+        :type keys: List[Tuple[str, str]]
+
+        :param loader: function which takes list of keys and returns dict with fetched values
+        :type loader: Callable[[List[Tuple[str, str]]], Dict[Tuple[str, str], Union[None, float]]]
+
+        :param max_age: max age of cached values in seconds (None - cache ttl, 0 - always fetch)
+        :type max_age: Union[None, float]
+
+        :return: values for all given keys (None if value can't be fetched)
+        :rtype: Dict[Tuple[str, str], Union[None, float]]
+        """
+
+        max_age = self.ttl if max_age is None else max_age
+        now = time.monotonic()
+
+        values = {}
+        own_flights = {}
+        foreign_flights = {}
+
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+
+                if entry and now - entry[1] <= max_age:
+                    values[key] = entry[0]
+                elif key in self._flights:
+                    foreign_flights[key] = self._flights[key]
+                else:
+                    own_flights[key] = self._flights[key] = _Flight()
+
+        if own_flights:
+            loaded = {}
+
+            try:
+                loaded = loader(list(own_flights))
+            finally:
+                with self._lock:
+                    for key, flight in own_flights.items():
+                        flight.value = loaded.get(key)
+
+                        if self._is_cacheable(flight.value):
+                            self._entries[key] = (flight.value, time.monotonic())
+
+                        del self._flights[key]
+                        flight.event.set()
+
+            for key in own_flights:
+                values[key] = loaded.get(key)
+
+        for key, flight in foreign_flights.items():
+            flight.event.wait()
+            values[key] = flight.value
+
+        return values
@@ -0,0 +1,76 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+
+class BurnRateEstimator:
+    """
+    Spend rate estimator: time-weighted EWMA of balance decrease speed ($ per hour), O(1) per sample.
+    Balance increases (top-ups) don't change the rate.
+    """
+
+    def __init__(self, half_life):
+        self._half_life = half_life  # hours
+
+        self._last_timestamp = None
+        self._last_balance = None
+        self.rate = None  # $ per hour
+
+    def update(self, timestamp, balance):
+        """
+        Add balance sample.
+
+        :param timestamp: sample unix timestamp
+        :type timestamp: float
+
+        :param balance: balance
+        :type balance: float
+
+        :return: None
+        """
+
+        if self._last_timestamp is None:
+            self._last_timestamp, self._last_balance = timestamp, balance
+            return
+
+        elapsed = (timestamp - self._last_timestamp) / 3600  # hours
+        if elapsed <= 0:
+            return
+
+        spent = self._last_balance - balance
+        self._last_timestamp, self._last_balance = timestamp, balance
+
+        if spent < 0:
+            return
+
+        sample_rate = spent / elapsed
+
+        if self.rate is None:
+            self.rate = sample_rate
+        else:
+            # the longer the gap between samples, the more weight the new sample gets
+            alpha = 1 - 0.5 ** (elapsed / self._half_life)
+            self.rate += alpha * (sample_rate - self.rate)
+
+    def hours_until(self, balance, target):
+        """
+        Projected time until balance drops to target at current spend rate.
+
+        :param balance: current balance
+        :type balance: float
+
+        :param target: target balance (e.g. critical border or zero)
+        :type target: float
+
+        :return: hours or None if balance isn't decreasing
+        :rtype: Union[None, float]
+        """
+
+        if not self.rate or self.rate <= 0:
+            return
+
+        return max(balance - target, 0) / self.rate
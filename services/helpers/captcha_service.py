@@ -0,0 +1,288 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+from services.helpers import metrics
+from services.helpers.singleton import Singleton
+
+_SOLVE_DURATION = metrics.histogram("captcha_solve_duration_seconds", "Duration of captcha solving.",
+                                    buckets=(5, 10, 20, 30, 45, 60, 90, 120, 180))
+_SOLVES = metrics.counter("captcha_solves", "Captcha solves by result (success, failure).", ("result",))
+_COST = metrics.counter("captcha_cost_dollars", "Cost of solved captchas.")
+_TOKENS = metrics.counter("captcha_tokens", "Solved tokens by outcome (prefetched_used, expired).", ("outcome",))
+
+
+class AntiCaptchaBackend:
+    """
+    Solver backend using anti-captcha.com (recaptcha v2 without proxy).
+    """
+
+    def __init__(self):
+        self._captcha_api_key = os.getenv("CAPTCHA_SERVICE_KEY")
+        self.solve_cost = float(os.getenv("CAPTCHA_SOLVE_COST", 0.002))  # $ per solved captcha
+
+    def solve(self, data_sitekey, url):
+        """
+        Solve recaptcha (blocks until solution is ready).
+
+        :param data_sitekey: recaptcha site key
+        :type data_sitekey: str
+
+        :param url: page url
+        :type url: str
+
+        :return: g-recaptcha-response token or None
+        :rtype: Union[None, str]
+        """
+
+        from anticaptchaofficial.recaptchav2proxyless import recaptchaV2Proxyless
+
+        solver = recaptchaV2Proxyless()
+        solver.set_verbose(0)
+        solver.set_key(self._captcha_api_key)
+        solver.set_website_url(url)
+        solver.set_website_key(data_sitekey)
+
+        return solver.solve_and_return_solution() or None
+
+
+class FakeCaptchaBackend:
+    """
+    Solver backend for tests and local runs: returns fake token after configured delay.
+    """
+
+    def __init__(self):
+        self._delay = float(os.getenv("CAPTCHA_FAKE_DELAY", 1))  # seconds
+        self._counter = itertools.count(1)
+        self.solve_cost = 0
+
+    def solve(self, data_sitekey, url):
+        """
+        Return fake token.
+
+        :param data_sitekey: recaptcha site key
+        :type data_sitekey: str
+
+        :param url: page url
+        :type url: str
+
+        :return: fake token
+        :rtype: str
+        """
+
+        time.sleep(self._delay)
+
+        return f"fake-token-{next(self._counter)}-{data_sitekey}"
+
+
+CAPTCHA_BACKENDS = {"anticaptcha": AntiCaptchaBackend, "fake": FakeCaptchaBackend}
+
+
+class CaptchaService(metaclass=Singleton):
+    """
+    Captcha solving in background threads. Solves can be started in advance (prefetch), solved token is kept until it
+    is taken or expires (recaptcha token is valid for two minutes). Concurrent requests for the same captcha share one
+    solve.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger("WorkingLoop.CaptchaService")
+
+        self._backend = CAPTCHA_BACKENDS[os.getenv("CAPTCHA_BACKEND", "anticaptcha")]()
+        self._token_ttl = float(os.getenv("CAPTCHA_TOKEN_TTL", 110))  # seconds
+        self._solve_timeout = float(os.getenv("CAPTCHA_SOLVE_TIMEOUT", 180))  # seconds
+        self._executor = ThreadPoolExecutor(max_workers=int(os.getenv("CAPTCHA_WORKERS", 2)),
+                                            thread_name_prefix="CaptchaSolvingThread")
+
+        self._tokens = {}  # (sitekey, url) -> (token, solve time)
+        self._solves = {}  # (sitekey, url) -> future of solve in flight
+        self._lock = threading.Lock()
+
+        self._metrics = {
+            "solves": 0,
+            "failures": 0,
+            "latency_seconds_total": 0.0,
+            "latency_seconds_last": 0.0,
+            "cost_total": 0.0,
+            "prefetched_tokens_used": 0,
+            "expired_tokens": 0,
+        }
+
+        self._logger.info(f"Captcha service initialized ({type(self._backend).__name__}).")
+
+    def _solve(self, key):
+        """
+        Solve captcha and keep token - target method for solving thread.
+
+        :param key: sitekey and url
+        :type key: Tuple[str, str]
+
+        :return: token or None
+        :rtype: Union[None, str]
+        """
+
+        start_time = time.monotonic()
+
+        try:
+            token = self._backend.solve(*key)
+        except Exception as error:
+            self._logger.error(f"Error occurred while solving captcha for {key[1]}: {error!r}")
+            token = None
+
+        latency = time.monotonic() - start_time
+
+        _SOLVE_DURATION.observe(latency)
+        _SOLVES.inc(result="success" if token else "failure")
+        if token:
+            _COST.inc(self._backend.solve_cost)
+
+        with self._lock:
+            self._solves.pop(key, None)
+
+            self._metrics["latency_seconds_total"] += latency
+            self._metrics["latency_seconds_last"] = latency
+            # solving service charges only for solved captcha
+            if token:
+                self._metrics["solves"] += 1
+                self._metrics["cost_total"] += self._backend.solve_cost
+                self._tokens[key] = (token, time.monotonic())
+            else:
+                self._metrics["failures"] += 1
+
+        if token:
+            self._logger.info(f"Captcha for {key[1]} solved in {latency:.1f} seconds "
+                              f"(total cost: {self._metrics['cost_total']:.3f}$).")
+        else:
+            self._logger.error(f"Can't solve captcha for {key[1]} ({latency:.1f} seconds).")
+
+        return token
+
+    def _take_token(self, key):
+        """
+        Take fresh solved token (token can be used once). Must be called under lock.
+
+        :param key: sitekey and url
+        :type key: Tuple[str, str]
+
+        :return: token or None
+        :rtype: Union[None, str]
+        """
+
+        token, solve_time = self._tokens.pop(key, (None, None))
+
+        if token and time.monotonic() - solve_time > self._token_ttl:
+            self._metrics["expired_tokens"] += 1
+            _TOKENS.inc(outcome="expired")
+            return
+
+        return token
+
+    def prefetch(self, data_sitekey, url):
+        """
+        Start solving in background (if there is no fresh token or solve in flight).
+
+        :param data_sitekey: recaptcha site key
+        :type data_sitekey: str
+
+        :param url: page url
+        :type url: str
+
+        :return: future of token
+        :rtype: concurrent.futures.Future
+        """
+
+        key = (data_sitekey, url)
+
+        with self._lock:
+            token, solve_time = self._tokens.get(key, (None, None))
+
+            if token and time.monotonic() - solve_time <= self._token_ttl:
+                future = Future()
+                future.set_result(token)
+            elif key in self._solves:
+                future = self._solves[key]
+            else:
+                future = self._solves[key] = self._executor.submit(self._solve, key)
+
+        return future
+
+    def get_token(self, data_sitekey, url):
+        """
+        Return fresh token: prefetched token if it is ready, else wait for solve (started now or already in flight).
+
+        :param data_sitekey: recaptcha site key
+        :type data_sitekey: str
+
+        :param url: page url
+        :type url: str
+
+        :return: token or None if captcha can't be solved
+        :rtype: Union[None, str]
+        """
+
+        key = (data_sitekey, url)
+        deadline = time.monotonic() + self._solve_timeout
+
+        while True:
+            with self._lock:
+                token = self._take_token(key)
+
+                if token:
+                    self._metrics["prefetched_tokens_used"] += 1
+                    _TOKENS.inc(outcome="prefetched_used")
+                    return token
+
+                if key not in self._solves:
+                    self._solves[key] = self._executor.submit(self._solve, key)
+
+                future = self._solves[key]
+
+            try:
+                if not future.result(timeout=max(deadline - time.monotonic(), 0)):
+                    return
+            except TimeoutError:
+                self._logger.error(f"Captcha for {url} wasn't solved in {self._solve_timeout} seconds.")
+                return
+
+            with self._lock:
+                token = self._take_token(key)
+
+            # token solved by shared solve can be taken by other caller, then new solve is started
+            if token:
+                return token
+
+    def expected_latency(self):
+        """
+        Average solve latency.
+
+        :return: latency in seconds (None if nothing was solved yet)
+        :rtype: Union[None, float]
+        """
+
+        with self._lock:
+            attempts = self._metrics["solves"] + self._metrics["failures"]
+
+            if attempts:
+                return self._metrics["latency_seconds_total"] / attempts
+
+    def metrics(self):
+        """
+        Return solving metrics: number of solves and failures, latency, cost, prefetch efficiency.
+
+        :return: metrics
+        :rtype: Dict[str, Union[int, float]]
+        """
+
+        with self._lock:
+            return dict(self._metrics)
@@ -0,0 +1,138 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import os
+import re
+
+from lxml import etree, html
+
+# xpath - precompiled XPath over lxml tree, regex is used if XPath finds nothing (e.g. after page layout change)
+# regex - regex only (page tree isn't built, search stops at first match)
+HTML_EXTRACTION_BACKEND = os.getenv("HTML_EXTRACTION_BACKEND", "xpath")
+
+_AMOUNT_PATTERN = re.compile(r"\$\s*(-?\d[\d,\u00a0 ]*(?:\.\d+)?)")
+
+
+def has_class(name):
+    """
+    XPath predicate which is equal to CSS class selector.
+
+    :param name: class name
+    :type name: str
+
+    :return: XPath predicate
+    :rtype: str
+    """
+
+    return f'[contains(concat(" ", normalize-space(@class), " "), " {name} ")]'
+
+
+def parse_amount(text):
+    """
+    Parse first dollar amount (e.g. "Balance: $ 1,234.50") from text.
+
+    :param text: text
+    :type text: Union[None, str]
+
+    :return: amount or None
+    :rtype: Union[None, float]
+    """
+
+    if text is None:
+        return
+
+    match = _AMOUNT_PATTERN.search(text)
+
+    if match is None:
+        return
+
+    try:
+        return float(re.sub(r"[,\u00a0 ]", "", match.group(1)))
+    except ValueError:
+        return
+
+
+class HtmlExtractor:
+    """
+    Extractor of one value from html page. XPath and regex are compiled once, extractor is thread-safe.
+    """
+
+    def __init__(self, xpath, pattern, backend=None):
+        """
+        :param xpath: XPath of element (its text is extracted) or attribute
+        :type xpath: str
+
+        :param pattern: regex with one group which captures value (dot matches newline)
+        :type pattern: str
+
+        :param backend: extraction backend (None - HTML_EXTRACTION_BACKEND)
+        :type backend: Union[None, str]
+        """
+
+        self._xpath = etree.XPath(xpath)
+        self._pattern = re.compile(pattern, re.DOTALL)
+        self._backend = backend or HTML_EXTRACTION_BACKEND
+
+    def extract_xpath(self, page):
+        """
+        Extract value using XPath.
+
+        :param page: html page
+        :type page: str
+
+        :return: value or None if not found
+        :rtype: Union[None, str]
+        """
+
+        try:
+            result = self._xpath(html.document_fromstring(page))
+        except (etree.ParserError, ValueError):
+            return
+
+        if not result:
+            return
+
+        if isinstance(result[0], etree._Element):
+            return "".join(result[0].itertext())
+
+        return str(result[0])
+
+    def extract_regex(self, page):
+        """
+        Extract value using regex.
+
+        :param page: html page
+        :type page: str
+
+        :return: value or None if not found
+        :rtype: Union[None, str]
+        """
+
+        match = self._pattern.search(page)
+
+        if match is not None:
+            return match.group(1)
+
+    def extract(self, page):
+        """
+        Extract value using configured backend.
+
+        :param page: html page
+        :type page: str
+
+        :return: value or None if not found
+        :rtype: Union[None, str]
+        """
+
+        if self._backend == "xpath":
+            value = self.extract_xpath(page)
+
+            if value is not None:
+                return value
+
+        return self.extract_regex(page)
@@ -0,0 +1,247 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from services.helpers import metrics
+
+LOG_FILE = os.getenv("LOG_FILE", "log.log")
+LOG_MODE = os.getenv("LOG_MODE", "async")  # async - records are written by listener thread, sync - inline
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json or text
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")  # size or time
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))  # bytes
+LOG_ROTATION_WHEN = os.getenv("LOG_ROTATION_WHEN", "midnight")  # TimedRotatingFileHandler interval type
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # records, records are dropped if queue is full
+LOG_MAX_MESSAGE_LENGTH = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", 4000))  # characters (e.g. response bodies)
+LOG_SAMPLING_WINDOW = float(os.getenv("LOG_SAMPLING_WINDOW", 60))  # seconds
+LOG_SAMPLING_BURST = int(os.getenv("LOG_SAMPLING_BURST", 5))  # similar records per window, 0 - no sampling
+
+TEXT_FORMAT = "%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_DROPPED_RECORDS = metrics.counter("log_records_dropped", "Log records dropped because logging queue is full.")
+_SUPPRESSED_RECORDS = metrics.counter("log_records_suppressed", "Repetitive log records suppressed by sampling.",
+                                      ("level",))
+
+# attributes of every LogRecord, the rest of attributes are passed by extra and added to json record
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "suppressed"}
+
+
+def _truncate(text):
+    """
+    Truncate text to max message length.
+
+    :param text: text
+    :type text: str
+
+    :return: text or its beginning with number of cut characters
+    :rtype: str
+    """
+
+    if LOG_MAX_MESSAGE_LENGTH and len(text) > LOG_MAX_MESSAGE_LENGTH:
+        return f"{text[:LOG_MAX_MESSAGE_LENGTH]}... ({len(text) - LOG_MAX_MESSAGE_LENGTH} characters cut)"
+
+    return text
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formatter which writes every record as one json line.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": _truncate(record.getMessage()),
+        }
+
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Plain text formatter (previous log format) with message truncation and suppressed records count.
+    """
+
+    def __init__(self):
+        super().__init__(fmt=TEXT_FORMAT, datefmt=TEXT_DATE_FORMAT)
+
+    def formatMessage(self, record):
+        record.message = _truncate(record.message)
+
+        if getattr(record, "suppressed", 0):
+            record.message += f" ({record.suppressed} similar records suppressed)"
+
+        return super().formatMessage(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate limit for repetitive warnings and errors: only burst of similar records (same logger, level and message with
+    numbers masked) passes per sampling window. First record passed in next window carries number of suppressed ones.
+    """
+
+    _max_keys = 1000
+
+    def __init__(self, window=LOG_SAMPLING_WINDOW, burst=LOG_SAMPLING_BURST, level=logging.WARNING):
+        super().__init__()
+
+        self._window = window
+        self._burst = burst
+        self._level = level
+
+        self._windows = {}  # key -> [window start, passed records, suppressed records]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(record):
+        """
+        Return key of similar records.
+
+        :param record: log record
+        :type record: logging.LogRecord
+
+        :return: key
+        :rtype: Tuple[str, int, str]
+        """
+
+        return record.name, record.levelno, re.sub(r"\d+", "#", record.getMessage()[:200])
+
+    def filter(self, record):
+        if not self._burst or record.levelno < self._level:
+            return True
+
+        key = self._key(record)
+        now = time.monotonic()
+
+        with self._lock:
+            state = self._windows.get(key)
+
+            if state is None or now - state[0] >= self._window:
+                if len(self._windows) >= self._max_keys:
+                    self._windows = {
+                        other_key: other_state for other_key, other_state in self._windows.items()
+                        if now - other_state[0] < self._window
+                    }
+
+                record.suppressed = state[2] if state else 0
+                self._windows[key] = [now, 1, 0]
+                return True
+
+            if state[1] < self._burst:
+                state[1] += 1
+                return True
+
+            state[2] += 1
+
+        _SUPPRESSED_RECORDS.inc(level=record.levelname)
+
+        return False
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Queue handler which never blocks: record is dropped if queue is full. Record is prepared in logging thread
+    (message is formatted, traceback is rendered), so it can be formatted later by listener thread.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DROPPED_RECORDS.inc()
+
+
+def _file_handler():
+    """
+    Create rotating file handler.
+
+    :return: file handler rotated by size or by time
+    :rtype: logging.Handler
+    """
+
+    if LOG_ROTATION == "time":
+        return TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATION_WHEN, backupCount=LOG_BACKUP_COUNT,
+                                        encoding="utf-8")
+
+    return RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+
+
+def configure(logger, level=logging.DEBUG):
+    """
+    Attach logging pipeline to logger: sampling filter, queue (in async mode) and rotating file handler with json or
+    text formatter. In async mode records are written to file by listener thread, so disk stalls don't block
+    logging threads; listener is stopped (and queue is flushed) at exit.
+
+    :param logger: logger
+    :type logger: logging.Logger
+
+    :param level: logger level
+    :type level: int
+
+    :return: queue listener (None in sync mode)
+    :rtype: Union[None, logging.handlers.QueueListener]
+    """
+
+    logger.setLevel(level)
+
+    file_handler = _file_handler()
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    file_handler.setLevel(level)
+
+    if LOG_MODE != "async":
+        file_handler.addFilter(SamplingFilter())
+        logger.addHandler(file_handler)
+        return
+
+    queue_handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.setLevel(level)
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
@@ -0,0 +1,361 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+"""
+Minimal thread-safe metrics registry (counters, gauges, histograms with labels) rendered in Prometheus text format
+and served by local http server (METRICS_PORT). Metrics are declared at module level with counter/gauge/histogram
+functions: declaring metric with existing name returns existing metric.
+"""
+
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    """
+    Format sample value.
+
+    :param value: value
+    :type value: float
+
+    :return: formatted value
+    :rtype: str
+    """
+
+    if value == math.inf:
+        return "+Inf"
+
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    """
+    Format labels set.
+
+    :param labels: label names and values
+    :type labels: List[Tuple[str, str]]
+
+    :return: formatted labels (empty string if there are no labels)
+    :rtype: str
+    """
+
+    if not labels:
+        return ""
+
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for name, value in labels
+    )
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Metric:
+    """
+    Base metric: values are kept per labels values tuple.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """
+        Convert labels to values key.
+
+        :param labels: label values by label names
+        :type labels: Dict[str, Any]
+
+        :return: labels values
+        :rtype: Tuple[str]
+        """
+
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} has labels {self.labelnames}, got {tuple(labels)}.")
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """
+        Return samples of metric.
+
+        :return: samples (name suffix, labels, value)
+        :rtype: List[Tuple[str, List[Tuple[str, str]], float]]
+        """
+
+        raise NotImplementedError
+
+    def render(self):
+        """
+        Render metric in Prometheus text format.
+
+        :return: lines
+        :rtype: List[str]
+        """
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value (rendered with _total suffix).
+    """
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Increase counter.
+
+        :param amount: non-negative amount
+        :type amount: float
+
+        :return: None
+        """
+
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [("_total", list(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """
+    Value which can go up and down.
+    """
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        """
+        Set gauge value.
+
+        :param value: value
+        :type value: float
+
+        :return: None
+        """
+
+        key = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, **labels):
+        """
+        Make gauge value computed by function on every scrape (e.g. queue size).
+
+        :param function: function without arguments which returns value
+        :type function: Callable[[], float]
+
+        :return: None
+        """
+
+        self.set(function, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = list(self._values.items())
+
+        return [("", list(zip(self.labelnames, key)), value() if callable(value) else value) for key, value in values]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets (with sum and count).
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        """
+        Observe value.
+
+        :param value: value (e.g. duration in seconds)
+        :type value: float
+
+        :return: None
+        """
+
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self._buckets, value)
+
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self._buckets), 0))
+            counts[bucket] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe duration of with-block.
+        """
+
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def _samples(self):
+        samples = []
+
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        for key, counts, total in values:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+
+            for upper_bound, count in zip(self._buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", labels + [("le", _format_value(upper_bound))], cumulative))
+
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Registry of metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric_class, name, documentation, labelnames=(), **kwargs):
+        """
+        Create metric or return existing metric with the same name.
+
+        :return: metric
+        :rtype: _Metric
+        """
+
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, documentation, labelnames, **kwargs)
+
+            metric = self._metrics[name]
+
+        if not isinstance(metric, metric_class) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"Metric {name} is already registered with other type or labels.")
+
+        return metric
+
+    def render(self):
+        """
+        Render all metrics in Prometheus text format.
+
+        :return: metrics page
+        :rtype: str
+        """
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = self.server.registry.render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """
+    Local http server which serves registry metrics on /metrics.
+    """
+
+    def __init__(self, host, port, registry=REGISTRY):
+        self._logger = logging.getLogger("WorkingLoop.MetricsServer")
+
+        self._server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self._server.registry = registry
+
+        self._logger.info(f"Metrics are served on http://{host}:{self._server.server_address[1]}/metrics.")
+
+    @property
+    def port(self):
+        """
+        Port server is bound to (useful if server was created with port 0).
+
+        :return: port
+        :rtype: int
+        """
+
+        return self._server.server_address[1]
+
+    def start(self):
+        """
+        Serve metrics in background thread.
+
+        :return: None
+        """
+
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="MetricsThread").start()
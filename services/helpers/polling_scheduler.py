@@ -0,0 +1,81 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import heapq
+import itertools
+
+
+class PollingScheduler:
+    """
+    Priority queue of next-due times. Every key is scheduled at most once (rescheduling replaces previous entry).
+    Not thread-safe: it is used only by balances checking thread.
+    """
+
+    def __init__(self):
+        self._heap = []  # (due time, sequence number, key)
+        self._due_times = {}  # key -> actual due time
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._due_times)
+
+    def schedule(self, key, due_time):
+        """
+        Schedule key to given time.
+
+        :param key: key (network, account)
+        :type key: Tuple[str, str]
+
+        :param due_time: monotonic time when key becomes due
+        :type due_time: float
+
+        :return: None
+        """
+
+        self._due_times[key] = due_time
+        heapq.heappush(self._heap, (due_time, next(self._counter), key))
+
+    def next_due_time(self):
+        """
+        Return nearest due time.
+
+        :return: monotonic time or None if nothing is scheduled
+        :rtype: Union[None, float]
+        """
+
+        while self._heap:
+            due_time, _, key = self._heap[0]
+
+            # entries replaced by rescheduling are dropped lazily
+            if self._due_times.get(key) == due_time:
+                return due_time
+
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now):
+        """
+        Remove and return all keys due at given time.
+
+        :param now: monotonic time
+        :type now: float
+
+        :return: due keys (in due order)
+        :rtype: List[Tuple[str, str]]
+        """
+
+        keys = []
+
+        while True:
+            due_time = self.next_due_time()
+
+            if due_time is None or due_time > now:
+                return keys
+
+            _, _, key = heapq.heappop(self._heap)
+            del self._due_times[key]
+            keys.append(key)
@@ -0,0 +1,65 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter of calls per second: calls are spaced evenly, every caller reserves its own slot.
+    """
+
+    def __init__(self, rate):
+        self._interval = 1 / rate if rate else 0  # seconds
+
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """
+        Reserve slot for call.
+
+        :return: seconds to wait until reserved slot
+        :rtype: float
+        """
+
+        if not self._interval:
+            return 0
+
+        with self._lock:
+            now = time.monotonic()
+            call_time = max(now, self._next_time)
+            self._next_time = call_time + self._interval
+
+        return call_time - now
+
+    def wait(self):
+        """
+        Block until call is allowed.
+
+        :return: None
+        """
+
+        delay = self._reserve()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self):
+        """
+        Wait until call is allowed without blocking event loop (slots are shared with sync callers).
+
+        :return: None
+        """
+
+        delay = self._reserve()
+
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -6,7 +6,248 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
+import os
+import random
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from services.helpers import metrics
+
+POOL_CONNECTIONS = int(os.getenv("REQUESTS_POOL_CONNECTIONS", 10))
+POOL_MAXSIZE = int(os.getenv("REQUESTS_POOL_MAXSIZE", 10))
+SESSION_IDLE_TIMEOUT = float(os.getenv("REQUESTS_SESSION_IDLE_TIMEOUT", 300))  # seconds
+
+CONNECT_TIMEOUT = float(os.getenv("REQUESTS_CONNECT_TIMEOUT", 5))  # seconds
+READ_TIMEOUT = float(os.getenv("REQUESTS_READ_TIMEOUT", 30))  # seconds
+RETRIES = int(os.getenv("REQUESTS_RETRIES", 2))  # for idempotent requests only
+RETRY_BACKOFF = float(os.getenv("REQUESTS_RETRY_BACKOFF", 0.5))  # seconds
+RETRY_BACKOFF_MAX = float(os.getenv("REQUESTS_RETRY_BACKOFF_MAX", 8))  # seconds
+BREAKER_FAILURES_THRESHOLD = int(os.getenv("BREAKER_FAILURES_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 60))  # seconds
+
+# gateway errors are treated as provider failures: they are retried and counted by circuit breaker
+_RETRY_STATUS_CODES = frozenset((502, 503, 504))
+
+_REQUEST_DURATION = metrics.histogram("http_request_duration_seconds", "Duration of outgoing http requests.",
+                                      ("host", "method"))
+_REQUESTS = metrics.counter("http_requests", "Outgoing http requests by result (status code, error, circuit_open).",
+                            ("host", "method", "result"))
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Request wasn't sent because circuit breaker of its host is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Thread-safe per-host circuit breaker. After failures threshold consecutive failures host circuit opens and
+    requests to host fail fast. After reset timeout one trial request is allowed (half-open state): its success closes
+    circuit, its failure opens circuit again.
+    """
+
+    def __init__(self, failures_threshold, reset_timeout):
+        self._failures_threshold = failures_threshold
+        self._reset_timeout = reset_timeout
+
+        self._hosts = {}  # host -> {"failures": consecutive failures, "opened": open time, "trial": trial is running}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """
+        Check that request to host can be sent.
+
+        :param host: host
+        :type host: str
+
+        :return: True if request is allowed, else False
+        :rtype: bool
+        """
+
+        with self._lock:
+            state = self._hosts.get(host)
+
+            if state is None or state["opened"] is None:
+                return True
+
+            if state["trial"] or time.monotonic() - state["opened"] < self._reset_timeout:
+                return False
+
+            state["trial"] = True
+            return True
+
+    def record(self, host, success):
+        """
+        Record request result.
+
+        :param host: host
+        :type host: str
+
+        :param success: False if host failed (network error or gateway error), else True
+        :type success: bool
+
+        :return: None
+        """
+
+        with self._lock:
+            if success:
+                self._hosts.pop(host, None)
+                return
+
+            state = self._hosts.setdefault(host, {"failures": 0, "opened": None, "trial": False})
+            state["failures"] += 1
+
+            if state["trial"] or state["failures"] >= self._failures_threshold:
+                state["opened"] = time.monotonic()
+
+            state["trial"] = False
+
+    def release(self, host):
+        """
+        Finish allowed request whose result says nothing about host health (e.g. invalid url, too many redirects):
+        trial slot of half-open circuit is freed, failures aren't changed.
+
+        :param host: host
+        :type host: str
+
+        :return: None
+        """
+
+        with self._lock:
+            state = self._hosts.get(host)
+
+            if state is not None:
+                state["trial"] = False
+
+
+class SessionPool:
+    """
+    Thread-safe pool of keep-alive sessions, one per host. Sessions idle longer than idle timeout are closed.
+    """
+
+    def __init__(self, pool_connections, pool_maxsize, idle_timeout):
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._idle_timeout = idle_timeout
+
+        self._sessions = {}  # host -> {"session": session, "last_used": time, "active": number of requests}
+        self._lock = threading.Lock()
+
+    def new_session(self, pool_maxsize=None, shared=False):
+        """
+        Create session with configured connection pool.
+
+        :param pool_maxsize: max number of keep-alive connections per host (None - pool default)
+        :type pool_maxsize: Union[None, int]
+
+        :param shared: session is shared between clients, so it must not keep cookies
+        :type shared: bool
+
+        :return: new session
+        :rtype: requests.Session
+        """
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self._pool_connections, pool_maxsize=pool_maxsize or self._pool_maxsize)
+
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        if shared:
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        return session
+
+    def acquire(self, url):
+        """
+        Return pooled session for host of given url. Every acquire must be followed by release.
+
+        :param url: request url
+        :type url: str
+
+        :return: session
+        :rtype: requests.Session
+        """
+
+        host = urlsplit(url).netloc
+        now = time.monotonic()
+
+        with self._lock:
+            self._evict_idle(now)
+
+            entry = self._sessions.get(host)
+
+            if entry is None:
+                session = self.new_session(shared=True)
+                entry = {"session": session, "last_used": now, "active": 0}
+                self._sessions[host] = entry
+
+            entry["last_used"] = now
+            entry["active"] += 1
+
+            return entry["session"]
+
+    def release(self, url):
+        """
+        Mark request to host of given url as finished.
+
+        :param url: request url
+        :type url: str
+
+        :return: None
+        """
+
+        host = urlsplit(url).netloc
+
+        with self._lock:
+            entry = self._sessions.get(host)
+
+            if entry is not None:
+                entry["last_used"] = time.monotonic()
+                entry["active"] -= 1
+
+    def _evict_idle(self, now):
+        """
+        Close sessions without active requests which weren't used for idle timeout. Must be called under lock.
+
+        :param now: current monotonic time
+        :type now: float
+
+        :return: None
+        """
+
+        for host, entry in list(self._sessions.items()):
+            if entry["active"] == 0 and now - entry["last_used"] > self._idle_timeout:
+                entry["session"].close()
+                del self._sessions[host]
+
+
+_session_pool = SessionPool(POOL_CONNECTIONS, POOL_MAXSIZE, SESSION_IDLE_TIMEOUT)
+_circuit_breaker = CircuitBreaker(BREAKER_FAILURES_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+def new_session(pool_maxsize=None, shared=False):
+    """
+    Create standalone session with configured connection pool, e.g. for web-interface login (with own cookies) or
+    for network with own connections limit (shared by network accounts).
+
+    :param pool_maxsize: max number of keep-alive connections per host (None - REQUESTS_POOL_MAXSIZE)
+    :type pool_maxsize: Union[None, int]
+
+    :param shared: session is shared between clients, so it must not keep cookies
+    :type shared: bool
+
+    :return: new session
+    :rtype: requests.Session
+    """
+
+    return _session_pool.new_session(pool_maxsize, shared)
 
 
 def catch_network_errors(method):
@@ -17,44 +258,139 @@ def catch_network_errors(method):
     def inner(*args, **kwargs):
         try:
             return method(*args, **kwargs)
-        except (
-                requests.exceptions.HTTPError,
-                requests.exceptions.ConnectTimeout,
-                requests.exceptions.Timeout,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.RequestException,
-                Exception,
-        ) as network_error:
+        except requests.exceptions.RequestException as network_error:
             return network_error
 
     return inner
 
 
+def _send(method, session, url, **kwargs):
+    """
+    Make one request using given session or pooled session for request host (if session is None).
+
+    :param method: http method
+    :type method: str
+
+    :param session: session for response making or None
+    :type session: Union[requests.Session, None]
+
+    :param url: request url
+    :type url: str
+
+    :return: response
+    :rtype: requests.Response
+    """
+
+    if session is not None:
+        return session.request(method, url, **kwargs)
+
+    session = _session_pool.acquire(url)
+
+    try:
+        return session.request(method, url, **kwargs)
+    finally:
+        _session_pool.release(url)
+
+
+def _request(method, session, url, retries, **kwargs):
+    """
+    Make request with default timeouts, jittered exponential retries and per-host circuit breaker.
+
+    :param method: http method
+    :type method: str
+
+    :param session: session for response making or None
+    :type session: Union[requests.Session, None]
+
+    :param url: request url
+    :type url: str
+
+    :param retries: max number of retries
+    :type retries: int
+
+    :return: response (response with gateway error status is returned after last retry)
+    :rtype: requests.Response
+    """
+
+    host = urlsplit(url).netloc
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(random.uniform(0, min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX)))
+
+        if not _circuit_breaker.allow(host):
+            _REQUESTS.inc(host=host, method=method, result="circuit_open")
+            raise CircuitOpenError(f"Circuit breaker for {host} is open.")
+
+        host_healthy = None  # None - request result says nothing about host health
+        start_time = time.perf_counter()
+
+        # every allowed request must finish with record or release, otherwise half-open circuit never closes
+        try:
+            response = _send(method, session, url, **kwargs)
+
+            _REQUEST_DURATION.observe(time.perf_counter() - start_time, host=host, method=method)
+            _REQUESTS.inc(host=host, method=method, result=response.status_code)
+            host_healthy = response.status_code not in _RETRY_STATUS_CODES
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            _REQUEST_DURATION.observe(time.perf_counter() - start_time, host=host, method=method)
+            _REQUESTS.inc(host=host, method=method, result="error")
+            host_healthy = False
+
+            if attempt == retries:
+                raise
+            continue
+        except requests.exceptions.RequestException:
+            _REQUEST_DURATION.observe(time.perf_counter() - start_time, host=host, method=method)
+            _REQUESTS.inc(host=host, method=method, result="error")
+            raise
+        finally:
+            if host_healthy is None:
+                _circuit_breaker.release(host)
+            else:
+                _circuit_breaker.record(host, host_healthy)
+
+        if host_healthy or attempt == retries:
+            return response
+
+        response.close()
+
+
 @catch_network_errors
-def get(session, *args, **kwargs):
+def get(session, url, retries=RETRIES, **kwargs):
     """
-    Make safe GET response using given session and arguments.
+    Make safe GET response using given session and arguments. Failed request is retried.
 
-    :param session: session for response making
-    :type session: requests.Session
+    :param session: session for response making (None - use pooled keep-alive session for request host)
+    :type session: Union[requests.Session, None]
+
+    :param url: request url
+    :type url: str
+
+    :param retries: max number of retries
+    :type retries: int
 
     :return: response if success, else catch error
     :rtype: Union[requests.Response, Exception]
     """
 
-    return session.get(*args, **kwargs)
+    return _request("GET", session, url, retries, **kwargs)
 
 
 @catch_network_errors
-def post(session, *args, **kwargs):
+def post(session, url, **kwargs):
     """
-    Make safe POST response using given session and arguments.
+    Make safe POST response using given session and arguments. POST isn't idempotent, so it isn't retried.
+
+    :param session: session for response making (None - use pooled keep-alive session for request host)
+    :type session: Union[requests.Session, None]
 
-    :param session: session for response making
-    :type session: requests.Session
+    :param url: request url
+    :type url: str
 
     :return: response if success, else catch error
     :rtype: Union[requests.Response, Exception]
     """
 
-    return session.post(*args, **kwargs)
+    return _request("POST", session, url, 0, **kwargs)
@@ -0,0 +1,165 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from cryptography.fernet import Fernet, InvalidToken
+from requests.cookies import RequestsCookieJar
+
+from services.helpers.singleton import Singleton
+
+
+class SessionStore(metaclass=Singleton):
+    """
+    Encrypted on-disk store of web-interface sessions (cookies, session creation time and user agent).
+    Store is disabled if SESSION_STORE_KEY (Fernet key) isn't set.
+    """
+
+    def __init__(self):
+        self._logger = logging.getLogger("WorkingLoop.SessionStore")
+        self._directory = os.getenv("SESSION_STORE_DIRECTORY", "sessions")
+        self._lock = threading.Lock()
+        self._fernet = None
+
+        key = os.getenv("SESSION_STORE_KEY")
+
+        if not key:
+            self._logger.warning("SESSION_STORE_KEY isn't set, web sessions won't be persisted. "
+                                 "Key can be generated with cryptography.fernet.Fernet.generate_key().")
+            return
+
+        try:
+            self._fernet = Fernet(key)
+        except ValueError as key_error:
+            self._logger.error(f"Incorrect SESSION_STORE_KEY, web sessions won't be persisted: {key_error}")
+            return
+
+        os.makedirs(self._directory, mode=0o700, exist_ok=True)
+        self._logger.info(f"Session store initialized ({self._directory}).")
+
+    @property
+    def enabled(self):
+        return self._fernet is not None
+
+    def _path(self, name):
+        """
+        Return path of file for session with given name.
+
+        :param name: session name (e.g. network and account)
+        :type name: str
+
+        :return: path
+        :rtype: str
+        """
+
+        return os.path.join(self._directory, hashlib.sha256(name.encode("utf-8")).hexdigest() + ".session")
+
+    def save(self, name, cookies, ctime, user_agent):
+        """
+        Encrypt and save session.
+
+        :param name: session name (e.g. network and account)
+        :type name: str
+
+        :param cookies: session cookies
+        :type cookies: requests.cookies.RequestsCookieJar
+
+        :param ctime: session creation time (UTC)
+        :type ctime: datetime
+
+        :param user_agent: user agent used for authorization
+        :type user_agent: str
+
+        :return: None
+        """
+
+        if not self.enabled:
+            return
+
+        data = {
+            "cookies": [
+                {"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "path": cookie.path,
+                 "secure": cookie.secure, "expires": cookie.expires}
+                for cookie in cookies
+            ],
+            "ctime": ctime.isoformat(),
+            "user_agent": user_agent,
+        }
+
+        path = self._path(name)
+        temporary_path = path + ".tmp"
+
+        with self._lock:
+            try:
+                with open(temporary_path, "wb") as session_file:
+                    os.chmod(temporary_path, 0o600)
+                    session_file.write(self._fernet.encrypt(json.dumps(data).encode("utf-8")))
+
+                os.replace(temporary_path, path)
+            except OSError as os_error:
+                self._logger.error(f"Can't save session {name}: {os_error}")
+
+    def load(self, name):
+        """
+        Load and decrypt session.
+
+        :param name: session name (e.g. network and account)
+        :type name: str
+
+        :return: cookies, session creation time and user agent if session exists, else None
+        :rtype: Union[None, Tuple[requests.cookies.RequestsCookieJar, datetime, str]]
+        """
+
+        if not self.enabled:
+            return
+
+        path = self._path(name)
+
+        with self._lock:
+            if not os.path.exists(path):
+                return
+
+            try:
+                with open(path, "rb") as session_file:
+                    data = json.loads(self._fernet.decrypt(session_file.read()))
+            except (OSError, InvalidToken, ValueError) as load_error:
+                self._logger.error(f"Can't load session {name}: {load_error!r}")
+                return
+
+        cookies = RequestsCookieJar()
+        for cookie in data["cookies"]:
+            cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"],
+                        secure=cookie["secure"], expires=cookie["expires"])
+
+        return cookies, datetime.fromisoformat(data["ctime"]), data["user_agent"]
+
+    def delete(self, name):
+        """
+        Delete session (e.g. if it was invalidated by site).
+
+        :param name: session name (e.g. network and account)
+        :type name: str
+
+        :return: None
+        """
+
+        if not self.enabled:
+            return
+
+        with self._lock:
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            except OSError as os_error:
+                self._logger.error(f"Can't delete session {name}: {os_error}")
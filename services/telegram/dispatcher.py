@@ -0,0 +1,263 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+import requests
+
+from services.helpers import metrics, requests_manager
+from services.helpers.singleton import Singleton
+
+MAX_MESSAGE_LENGTH = 4096
+
+_SEND_DURATION = metrics.histogram("telegram_send_duration_seconds", "Duration of telegram bot api requests.",
+                                   ("method",))
+_RATE_LIMITED = metrics.counter("telegram_rate_limited", "Telegram bot api requests rejected with 429.", ("method",))
+_QUEUE_SIZE = metrics.gauge("telegram_send_queue_size", "Number of queued telegram bot api requests.")
+
+
+class _Message:
+    """
+    Outbound request waiting in chat queue. Coalesced messages share one request, so message keeps futures of all of
+    them.
+    """
+
+    def __init__(self, method, params, coalesce, ready_time):
+        self.method = method
+        self.params = params
+        self.coalesce = coalesce
+        self.ready_time = ready_time
+        self.futures = [Future()]
+
+
+class Dispatcher(metaclass=Singleton):
+    """
+    Outbound telegram requests queue with dedicated dispatching thread. Requests are sent with respect to global and
+    per-chat rate limits (chats are served in round-robin order), 429 responses are retried after retry_after.
+    Coalescable messages (alerts) for the same chat are held for coalescing window and joined into one message.
+    """
+
+    def __init__(self, telegram_access_token):
+        self._logger = logging.getLogger("WorkingLoop.Dispatcher")
+
+        self._requests_url = f"https://api.telegram.org/bot{telegram_access_token}/"
+        self._global_interval = 1 / float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))  # seconds
+        self._chat_interval = float(os.getenv("TELEGRAM_CHAT_INTERVAL", 1))  # seconds
+        self._coalescing_window = float(os.getenv("TELEGRAM_COALESCING_WINDOW", 3))  # seconds
+
+        self._queues = OrderedDict()  # chat id -> deque of messages
+        self._chat_next_time = {}  # chat id -> monotonic time when next message can be sent
+        self._global_next_time = 0
+        self._condition = threading.Condition()
+
+        _QUEUE_SIZE.set_function(self.queue_size)
+
+        self._thread = threading.Thread(target=self._dispatch, daemon=True, name="DispatchingThread")
+        self._thread.start()
+
+        self._logger.info("Dispatcher initialized.")
+
+    def submit(self, method, params, coalesce=False):
+        """
+        Put request to queue of its chat.
+
+        :param method: telegram bot api method
+        :type method: str
+
+        :param params: request params (must contain chat_id)
+        :type params: Dict[str, Any]
+
+        :param coalesce: message can be joined with other coalescable messages of the same chat
+        :type coalesce: bool
+
+        :return: future of message id (None if request failed)
+        :rtype: concurrent.futures.Future
+        """
+
+        ready_time = time.monotonic() + (self._coalescing_window if coalesce else 0)
+        message = _Message(method, params, coalesce, ready_time)
+
+        with self._condition:
+            self._queues.setdefault(params["chat_id"], deque()).append(message)
+            self._condition.notify()
+
+        return message.futures[0]
+
+    def queue_size(self):
+        """
+        Return number of queued requests.
+
+        :return: queue size
+        :rtype: int
+        """
+
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _next_message(self):
+        """
+        Wait until some chat has ready message and rate limits allow to send it, then remove it from queue (with
+        coalescable messages joined to it). Must be called under condition lock.
+
+        :return: chat id and message
+        :rtype: Tuple[int, _Message]
+        """
+
+        while True:
+            chat_id, ready_time = None, None
+
+            for queue_chat_id, queue in self._queues.items():
+                queue_ready_time = max(queue[0].ready_time, self._chat_next_time.get(queue_chat_id, 0))
+
+                if ready_time is None or queue_ready_time < ready_time:
+                    chat_id, ready_time = queue_chat_id, queue_ready_time
+
+            if chat_id is None:
+                self._condition.wait()
+                continue
+
+            timeout = max(ready_time, self._global_next_time) - time.monotonic()
+            if timeout > 0:
+                self._condition.wait(timeout)
+                continue
+
+            queue = self._queues.pop(chat_id)
+            message = queue.popleft()
+
+            if message.coalesce:
+                self._coalesce(message, queue)
+
+            # chat is moved to the end of queues order, so other chats are served first
+            if queue:
+                self._queues[chat_id] = queue
+
+            return chat_id, message
+
+    @staticmethod
+    def _coalesce(message, queue):
+        """
+        Join coalescable messages from chat queue to given message (while it fits into telegram message).
+
+        :param message: message
+        :type message: _Message
+
+        :param queue: chat queue
+        :type queue: deque
+
+        :return: None
+        """
+
+        for other in list(queue):
+            if not other.coalesce or other.params.get("parse_mode") != message.params.get("parse_mode"):
+                continue
+
+            text = message.params["text"] + "\n\n" + other.params["text"]
+            if len(text) > MAX_MESSAGE_LENGTH:
+                break
+
+            queue.remove(other)
+            message.params = dict(message.params, text=text)
+            message.futures.extend(other.futures)
+
+    def _send(self, message):
+        """
+        Send request.
+
+        :param message: message
+        :type message: _Message
+
+        :return: response if success, else catch error
+        :rtype: Union[requests.Response, Exception]
+        """
+
+        return requests_manager.post(None, self._requests_url + message.method, params=message.params)
+
+    def _retry_after(self, response):
+        """
+        Extract retry_after from 429 response.
+
+        :param response: response
+        :type response: requests.Response
+
+        :return: seconds to wait
+        :rtype: float
+        """
+
+        try:
+            return float(response.json()["parameters"]["retry_after"])
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            return float(response.headers.get("Retry-After", 1))
+
+    def _message_id(self, response, method):
+        """
+        Extract message id from sendMessage/editMessageText response.
+
+        :param response: response or error
+        :type response: Union[requests.Response, Exception]
+
+        :param method: telegram bot api method (for logs)
+        :type method: str
+
+        :return: message id if success, else None
+        :rtype: Union[int, None]
+        """
+
+        if not isinstance(response, requests.Response):
+            self._logger.error(f"Error occurred while trying to {method}: {response}")
+            return
+
+        try:
+            return response.json()["result"]["message_id"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            self._logger.error(f"Can't {method}, response: {response.text}")
+
+    def _dispatch(self):
+        """
+        Send queued requests in infinite loop - target method for DispatchingThread.
+        """
+
+        while True:
+            with self._condition:
+                chat_id, message = self._next_message()
+
+            try:
+                with _SEND_DURATION.time(method=message.method):
+                    response = self._send(message)
+            except Exception as error:
+                # dispatching thread must survive any error, otherwise all waiting senders hang
+                response = error
+
+            now = time.monotonic()
+
+            with self._condition:
+                if isinstance(response, requests.Response) and response.status_code == 429:
+                    _RATE_LIMITED.inc(method=message.method)
+                    retry_after = self._retry_after(response)
+                    self._logger.warning(f"Telegram rate limit exceeded, retry {message.method} after "
+                                         f"{retry_after} seconds.")
+
+                    # message keeps its place in chat queue and all requests wait for retry_after
+                    self._queues.setdefault(chat_id, deque()).appendleft(message)
+                    self._queues.move_to_end(chat_id, last=False)
+                    self._global_next_time = now + retry_after
+                    self._chat_next_time[chat_id] = now + retry_after
+                    continue
+
+                self._global_next_time = now + self._global_interval
+                self._chat_next_time[chat_id] = now + self._chat_interval
+
+            message_id = self._message_id(response, message.method)
+
+            for future in message.futures:
+                future.set_result(message_id)
@@ -9,9 +9,8 @@
 import json
 import logging
 
-import requests
-
-from services.helpers import requests_manager
+from services.telegram.dispatcher import Dispatcher
+from services.ts_clients.network_specs import NETWORK_ALIASES
 
 
 def _button(text):
@@ -30,20 +29,18 @@ def _button(text):
 
 class Sender:
     """
-    Service for messages sending.
+    Service for messages sending. Messages are sent by dispatcher (rate limited queue shared by all senders).
     """
 
     def __init__(self, telegram_access_token):
         self._logger = logging.getLogger("WorkingLoop.Sender")
 
-        self._requests_url = f"https://api.telegram.org/bot{telegram_access_token}/"
+        self._dispatcher = Dispatcher(telegram_access_token)
         self._basic_keyboard = json.dumps(
             {
                 "keyboard": [
                     [_button("/get_balance")],
-                    [_button("/get_balance prop"), _button("/get_balance eva")],
-                    [_button("/get_balance pushhouse"), _button("/get_balance dao")],
-                    [_button("/get_balance zero"), _button("/get_balance mgid")],
+                    *self._network_buttons(),
                     [_button("/help")],
                 ],
                 "resize_keyboard": True,
@@ -52,9 +49,48 @@ class Sender:
 
         self._logger.info("Sender initialized.")
 
+    @staticmethod
+    def _network_buttons():
+        """
+        Create /get_balance buttons for all networks (two buttons in row).
+
+        :return: keyboard rows
+        :rtype: List[List[Dict[str, str]]]
+        """
+
+        buttons = [_button(f"/get_balance {alias}") for alias in NETWORK_ALIASES]
+
+        return [buttons[index:index + 2] for index in range(0, len(buttons), 2)]
+
+    def send_message_async(self, to, text, parse_mode="HTML", coalesce=False):
+        """
+        Queue message with given text to given user.
+
+        :param to: message receiver chat id
+        :type to: int
+
+        :param text: message text
+        :type text: str
+
+        :param parse_mode: parse mode for telegram formatting
+        :type parse_mode: str
+
+        :param coalesce: message (e.g. alert) can be joined with other such messages to the same user
+        :type coalesce: bool
+
+        :return: future of sent message id (None if message wasn't sent)
+        :rtype: concurrent.futures.Future
+        """
+
+        return self._dispatcher.submit(
+            "sendMessage",
+            {"chat_id": to, "text": text, "parse_mode": parse_mode, "reply_markup": self._basic_keyboard},
+            coalesce,
+        )
+
     def send_message(self, to, text, parse_mode="HTML"):
         """
-        Send message with given text to given user.
+        Send message with given text to given user and wait until it is sent.
 
         :param to: message receiver chat id
         :type to: int
@@ -65,16 +101,33 @@ class Sender:
         :param parse_mode: parse mode for telegram formatting
         :type parse_mode: str
 
-        :return: None
+        :return: sent message id if success, else None
+        :rtype: Union[int, None]
         """
 
-        method = "sendMessage"
+        return self.send_message_async(to, text, parse_mode).result()
 
-        response = requests_manager.post(
-            requests.Session(),
-            self._requests_url + method,
-            params={"chat_id": to, "text": text, "parse_mode": parse_mode, "reply_markup": self._basic_keyboard},
-        )
+    def edit_message(self, chat_id, message_id, text, parse_mode="HTML"):
+        """
+        Replace text of previously sent message and wait until it is edited.
+
+        :param chat_id: chat id
+        :type chat_id: int
+
+        :param message_id: id of message to edit
+        :type message_id: int
+
+        :param text: new message text
+        :type text: str
+
+        :param parse_mode: parse mode for telegram formatting
+        :type parse_mode: str
+
+        :return: message id if success, else None
+        :rtype: Union[int, None]
+        """
 
-        if not isinstance(response, requests.Response):
-            self._logger.error(f"Error occurred while trying to send message: {response}")
+        return self._dispatcher.submit(
+            "editMessageText",
+            {"chat_id": chat_id, "message_id": message_id, "text": text, "parse_mode": parse_mode},
+        ).result()
@@ -8,6 +8,8 @@
 
 import json
 import logging
+import os
+import time
 
 import requests
 
@@ -22,29 +24,39 @@ class Updater:
     def __init__(self, telegram_access_token):
         self._requests_url = f"https://api.telegram.org/bot{telegram_access_token}/"
         self._logger = logging.getLogger(__name__)
+        self._network_error_delay = float(os.getenv("UPDATES_NETWORK_ERROR_DELAY", 1))  # seconds
 
         self._logger.info("Updater was successfully initialized.")
 
-    def get_updates(self, offset=None, timeout=10):
+    def get_updates(self, offset=None, timeout=10, limit=100):
         """
         Get updates list from telegram.
 
         :param offset: offset (last update id)
         :type offset: int
 
-        :param timeout: timeout
+        :param timeout: long polling timeout in seconds
         :type timeout: int
 
+        :param limit: max number of updates (1-100)
+        :type limit: int
+
         :return: updates list
         :rtype: list
         """
 
         method = "getUpdates"
-        response = requests_manager.get(requests.Session(), self._requests_url + method,
-                                        params={"offset": offset, "timeout": timeout})
+        # telegram holds long polling request up to timeout, so read timeout must be longer; polling loop repeats
+        # request anyway, so it isn't retried
+        response = requests_manager.get(None, self._requests_url + method, retries=0,
+                                        params={"offset": offset, "timeout": timeout, "limit": limit},
+                                        timeout=(requests_manager.CONNECT_TIMEOUT,
+                                                 timeout + requests_manager.READ_TIMEOUT))
 
         if not isinstance(response, requests.Response):
             self._logger.error(f"Network error occurred while trying to get updates from telegram: {response}")
+            # failed requests (e.g. while circuit breaker is open) return immediately, don't spin listening loop
+            time.sleep(self._network_error_delay)
             return []
         if response.status_code != 200:
             self._logger.error(
@@ -63,3 +75,61 @@ class Updater:
         else:
             self._logger.error(f"Get response with incorrect structure (telegram updates): {response_json}")
             return []
+
+    def _call(self, method, params):
+        """
+        Call telegram method which returns bool result.
+
+        :param method: telegram bot api method
+        :type method: str
+
+        :param params: method params
+        :type params: Dict[str, Any]
+
+        :return: True if success, else False
+        :rtype: bool
+        """
+
+        response = requests_manager.post(None, self._requests_url + method, params=params)
+
+        if not isinstance(response, requests.Response):
+            self._logger.error(f"Network error occurred while trying to call {method}: {response}")
+            return False
+
+        try:
+            response_json = response.json()
+        except json.JSONDecodeError:
+            self._logger.error(f"Can't decode {method} response from telegram: {response.text}")
+            return False
+
+        if not response_json.get("ok"):
+            self._logger.error(f"Telegram {method} failed: {response_json}")
+            return False
+
+        return True
+
+    def set_webhook(self, url, secret_token):
+        """
+        Make telegram push updates to given url (long polling doesn't work while webhook is set).
+
+        :param url: public https url of webhook server
+        :type url: str
+
+        :param secret_token: token which telegram sends in every webhook request
+        :type secret_token: str
+
+        :return: True if success, else False
+        :rtype: bool
+        """
+
+        return self._call("setWebhook", {"url": url, "secret_token": secret_token})
+
+    def delete_webhook(self):
+        """
+        Remove webhook, so updates can be received by long polling.
+
+        :return: True if success, else False
+        :rtype: bool
+        """
+
+        return self._call("deleteWebhook", {})
@@ -0,0 +1,142 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import hmac
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_UPDATE_SIZE = 1024 * 1024  # bytes
+
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of telegram webhook requests: every request contains one update.
+    """
+
+    server_version = "BalanceBotWebhook"
+
+    def _respond(self, status_code):
+        """
+        Send empty response with given status code.
+
+        :param status_code: http status code
+        :type status_code: int
+
+        :return: None
+        """
+
+        self.send_response(status_code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        webhook = self.server.webhook
+
+        if self.path != webhook.path:
+            self._respond(404)
+            return
+
+        if not hmac.compare_digest(self.headers.get(SECRET_TOKEN_HEADER, ""), webhook.secret_token):
+            webhook.logger.warning(f"Webhook request with invalid secret token from {self.client_address[0]}.")
+            self._respond(403)
+            return
+
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            content_length = -1
+
+        if not 0 < content_length <= MAX_UPDATE_SIZE:
+            self._respond(400)
+            return
+
+        try:
+            update = json.loads(self.rfile.read(content_length))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            webhook.logger.error("Can't decode update from webhook request.")
+            self._respond(400)
+            return
+
+        if not isinstance(update, dict) or "update_id" not in update:
+            webhook.logger.error(f"Get webhook update with incorrect structure: {update}")
+            self._respond(400)
+            return
+
+        # update is accepted even if it can't be queued, otherwise telegram redelivers it forever
+        try:
+            webhook.put_update(update)
+        except Exception as error:
+            webhook.logger.error(f"Error occurred while queueing webhook update {update}: {error!r}")
+
+        self._respond(200)
+
+    def log_message(self, format, *args):
+        self.server.webhook.logger.debug(f"{self.client_address[0]} - {format % args}")
+
+
+class WebhookServer:
+    """
+    Lightweight local http server which receives updates pushed by telegram (webhook) and passes them to given
+    callback. Every request is checked for secret token which is set together with webhook.
+    """
+
+    def __init__(self, put_update, host, port, path, secret_token):
+        self.logger = logging.getLogger("WorkingLoop.WebhookServer")
+
+        self.put_update = put_update
+        self.path = path
+        self.secret_token = secret_token
+
+        self._server = ThreadingHTTPServer((host, port), _WebhookRequestHandler)
+        self._server.daemon_threads = True
+        self._server.webhook = self
+
+        self.logger.info(f"Webhook server listens on {host}:{self._server.server_address[1]}{path}.")
+
+    @property
+    def port(self):
+        """
+        Port server is bound to (useful if server was created with port 0).
+
+        :return: port
+        :rtype: int
+        """
+
+        return self._server.server_address[1]
+
+    def serve_forever(self):
+        """
+        Handle webhook requests until shutdown.
+
+        :return: None
+        """
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def close(self):
+        """
+        Close server socket (for server which isn't serving).
+
+        :return: None
+        """
+
+        self._server.server_close()
+
+    def shutdown(self):
+        """
+        Stop serving (must be called from other thread than serve_forever).
+
+        :return: None
+        """
+
+        self._server.shutdown()
@@ -0,0 +1,232 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import json
+import os
+import re
+
+import requests
+
+from services.helpers import requests_manager
+from services.helpers.rate_limiter import RateLimiter
+from services.ts_clients.network_specs import compile_json_path
+from services.ts_clients.ts_client import DEFAULT_ACCOUNT, TrafficSourceClient
+
+
+class ApiClient(TrafficSourceClient):
+    """
+    Generic api-interface client which executes network spec (see network_specs). Client class is created for every
+    spec by make_api_client_class: accounts of one network share compiled balance path, rate limiter and session.
+    """
+
+    spec = None
+    network_fullname = None
+    network_alias = None
+
+    _balance_getter = None
+    _bulk_getters = None  # items, item id and item balance getters (None if network has no bulk endpoint)
+    _rate_limiter = None
+    _session = None
+
+    def __init__(self, telegram_access_token, account=None):
+        credentials = self.spec["credentials"]
+        account = account or dict({"name": DEFAULT_ACCOUNT},
+                                  **{field: os.getenv(variable) for field, variable in credentials.items()})
+
+        self._credentials = {field: account.get(field) for field in credentials}
+        self._account_id = account.get(self.spec["bulk"]["account_field"]) if "bulk" in self.spec else None
+
+        super().__init__(
+            telegram_access_token=telegram_access_token,
+            network_fullname=self.spec["name"],
+            network_alias=self.spec["alias"],
+            interface="api",
+            account_name=account["name"],
+            access_token=self._credentials["access_token"])
+
+    def has_credentials(self):
+        """
+        Check that all credentials from spec are set.
+
+        :return: True if credentials are set, else False
+        :rtype: bool
+        """
+
+        return all(self._credentials.values())
+
+    def _balance_request(self):
+        """
+        Return url and request kwargs for balance request described by spec.
+
+        :return: url and kwargs for GET-request
+        :rtype: Tuple[str, dict]
+        """
+
+        return self.spec["url"].format(**self._credentials), self._request_kwargs(self._access_token)
+
+    @classmethod
+    def _request_kwargs(cls, access_token):
+        """
+        Return request kwargs (headers and params with access token by spec auth scheme).
+
+        :param access_token: access token
+        :type access_token: str
+
+        :return: kwargs for GET-request
+        :rtype: dict
+        """
+
+        headers = dict(cls.spec.get("headers", {}))
+        params = dict(cls.spec.get("params", {}))
+        auth = cls.spec["auth"]
+
+        if auth["scheme"] == "bearer":
+            headers["Authorization"] = f"Bearer {access_token}"
+        elif auth["scheme"] == "header":
+            headers[auth["header"]] = access_token
+        else:
+            params[auth["param"]] = access_token
+
+        request_kwargs = {"headers": headers}
+        if params:
+            request_kwargs["params"] = params
+
+        return request_kwargs
+
+    def _parse_balance_response(self, balance_response):
+        """
+        Get balance from balance response using spec balance path.
+
+        :param balance_response: balance response
+        :type balance_response: Union[requests.Response, async_requests_manager.Response]
+
+        :return: balance or None
+        :rtype: Union[None, float]
+        """
+
+        if balance_response.status_code != 200:
+            self._logger.error(f"Can't get {self.display_name} balance: get response with status code "
+                               f"{balance_response.status_code}. Response: {balance_response.text}")
+            return
+
+        try:
+            balance_response_json = balance_response.json()
+        except json.JSONDecodeError as decode_error:
+            self._logger.error(f"Decode error occurred while trying to parse balance response for "
+                               f"{self.display_name}, doc: {decode_error.doc}")
+            return
+
+        try:
+            return float(self._balance_getter(balance_response_json))
+        except (KeyError, IndexError, TypeError, ValueError):
+            self._logger.error(f"Can't get {self.display_name} balance by path {self.spec['balance_path']} from "
+                               f"balance response json. Value: {balance_response_json}")
+
+    def get_balance(self):
+        """
+        Get balance (with network rate limit, using network session).
+
+        :return: balance or None
+        :rtype: Union[None, float]
+        """
+
+        self._rate_limiter.wait()
+
+        url, request_kwargs = self._balance_request()
+        balance_response = requests_manager.get(self._session, url, **request_kwargs)
+
+        if not isinstance(balance_response, requests.Response):
+            self._logger.error(f"Error occurred while trying to get {self.display_name} balance: {balance_response}")
+            return
+
+        return self._parse_balance_response(balance_response)
+
+    @classmethod
+    def _get_balances_batch(cls, clients):
+        """
+        Get balances of accounts with account id using spec bulk endpoint (one request for all accounts). Bulk request
+        is made only if network has bulk endpoint, its credentials are set and there are at least two accounts.
+
+        :param clients: clients (accounts) of this class
+        :type clients: List[ApiClient]
+
+        :return: balances of accounts found in bulk response
+        :rtype: Dict[ApiClient, Union[None, float]]
+        """
+
+        if cls._bulk_getters is None:
+            return {}
+
+        bulk = cls.spec["bulk"]
+        credentials = {field: os.getenv(variable) for field, variable in bulk["credentials"].items()}
+
+        clients_by_id = {}
+        for client in clients:
+            if client._account_id:
+                clients_by_id.setdefault(str(client._account_id), []).append(client)
+
+        if not all(credentials.values()) or len(clients_by_id) < 2:
+            return {}
+
+        logger = clients[0]._logger
+        cls._rate_limiter.wait()
+
+        bulk_response = requests_manager.get(cls._session, bulk["url"].format(**credentials),
+                                             **cls._request_kwargs(credentials["access_token"]))
+
+        if not isinstance(bulk_response, requests.Response):
+            logger.error(f"Error occurred while trying to get {cls.network_fullname} balances in bulk: {bulk_response}")
+            return {}
+
+        if bulk_response.status_code != 200:
+            logger.error(f"Can't get {cls.network_fullname} balances in bulk: get response with status code "
+                         f"{bulk_response.status_code}. Response: {bulk_response.text}")
+            return {}
+
+        items_getter, item_id_getter, item_balance_getter = cls._bulk_getters
+        balances = {}
+
+        try:
+            items = items_getter(bulk_response.json())
+
+            for item in items:
+                for client in clients_by_id.get(str(item_id_getter(item)), ()):
+                    balances[client] = float(item_balance_getter(item))
+        except (json.JSONDecodeError, KeyError, IndexError, TypeError, ValueError) as error:
+            logger.error(f"Can't parse {cls.network_fullname} bulk balances response ({error!r}): "
+                         f"{bulk_response.text}")
+            return {}
+
+        # accounts missing in bulk response are fetched one by one
+        return balances
+
+
+def make_api_client_class(spec):
+    """
+    Create client class for api-interface network spec.
+
+    :param spec: network spec
+    :type spec: Dict[str, Any]
+
+    :return: client class
+    :rtype: type
+    """
+
+    class_name = spec.get("class_name") or re.sub(r"\W", "", spec["name"]) + "Client"
+
+    return type(class_name, (ApiClient,), {
+        "spec": spec,
+        "network_fullname": spec["name"],
+        "network_alias": spec["alias"],
+        "_balance_getter": staticmethod(compile_json_path(spec["balance_path"])),
+        "_bulk_getters": tuple(
+            compile_json_path(spec["bulk"][key]) for key in ("items_path", "item_id_path", "balance_path")
+        ) if "bulk" in spec else None,
+        "_rate_limiter": RateLimiter(spec.get("rate_limit", 0)),
+        "_session": requests_manager.new_session(spec.get("pool_size"), shared=True),
+    })
@@ -0,0 +1,113 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+import asyncio
+import time
+
+from services.helpers import async_requests_manager
+
+
+class AsyncTrafficSourceClient:
+    """
+    Async variant of TrafficSourceClient contract. Wraps sync client: balance is fetched in event loop,
+    database access and notifications are delegated to wrapped client in default executor.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._logger = client._logger
+
+        self.network_fullname = client.network_fullname
+        self.network_alias = client.network_alias
+        self.account_name = client.account_name
+        self.display_name = client.display_name
+        self.interface = client.interface
+
+    async def get_balance(self):
+        raise NotImplementedError
+
+    async def check_balance(self):
+        """
+        Check balance and send notification if necessary.
+
+        :return: fetched balance (None if network is disabled or balance can't be fetched)
+        :rtype: Union[None, float]
+        """
+
+        loop = asyncio.get_running_loop()
+
+        if not await loop.run_in_executor(None, self._client.is_enabled):
+            return
+
+        start_time = time.perf_counter()
+        balance = await self.get_balance()
+        self._client.record_balance_fetch(time.perf_counter() - start_time, balance)
+
+        await loop.run_in_executor(None, self._client.handle_balance, balance)
+
+        return balance
+
+
+class AsyncApiClient(AsyncTrafficSourceClient):
+    """
+    Native async client for api-interface networks: makes request described by wrapped client on shared
+    aiohttp session (with network rate limit of wrapped client).
+    """
+
+    async def get_balance(self):
+        """
+        Get balance.
+
+        :return: balance or None
+        :rtype: Union[None, float]
+        """
+
+        await self._client._rate_limiter.wait_async()
+
+        url, request_kwargs = self._client._balance_request()
+        balance_response = await async_requests_manager.get(async_requests_manager.shared_session(), url,
+                                                            **request_kwargs)
+
+        if not isinstance(balance_response, async_requests_manager.Response):
+            self._logger.error(f"Error occurred while trying to get {self.display_name} balance: {balance_response}")
+            return
+
+        return self._client._parse_balance_response(balance_response)
+
+
+class SyncClientAdapter(AsyncTrafficSourceClient):
+    """
+    Adapter for sync clients (e.g. web-interface clients): runs blocking get_balance in default executor.
+    """
+
+    async def get_balance(self):
+        """
+        Get balance.
+
+        :return: balance or None
+        :rtype: Union[None, float]
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, self._client.get_balance)
+
+
+def make_async_client(client):
+    """
+    Create async client for given sync client.
+
+    :param client: sync client
+    :type client: TrafficSourceClient
+
+    :return: native async client for api-interface, else adapter
+    :rtype: AsyncTrafficSourceClient
+    """
+
+    if client.interface == "api":
+        return AsyncApiClient(client)
+
+    return SyncClientAdapter(client)
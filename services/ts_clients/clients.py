@@ -6,9 +6,29 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
-from services.ts_clients.daopush_client import DaoPushClient
-from services.ts_clients.evadav_client import EvadavClient
-from services.ts_clients.propeller_client import PropellerClient
-from services.ts_clients.pushhouse_client import PushHouseClient
-from services.ts_clients.zeropark_client import ZeroParkClient
-from services.ts_clients.mgid_client import MgidClient
+from importlib import import_module
+
+from services.ts_clients.api_client import make_api_client_class
+from services.ts_clients.network_specs import NETWORK_SPECS
+
+
+def _client_class(spec):
+    """
+    Return client class for network spec: generated class for api-interface network or class from client_class path
+    for web-interface network.
+
+    :param spec: network spec
+    :type spec: Dict[str, Any]
+
+    :return: client class
+    :rtype: type
+    """
+
+    if spec["interface"] == "api":
+        return make_api_client_class(spec)
+
+    module_name, class_name = spec["client_class"].rsplit(".", 1)
+    return getattr(import_module(module_name), class_name)
+
+
+NETWORK_CLIENTS = {spec["name"]: _client_class(spec) for spec in NETWORK_SPECS}
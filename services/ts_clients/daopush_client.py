@@ -11,21 +11,36 @@ import time
 from datetime import datetime
 
 import requests
-from bs4 import BeautifulSoup
 
 from services.helpers import requests_manager
-from services.ts_clients.ts_client import TrafficSourceClient
+from services.helpers.html_extractor import HtmlExtractor, has_class, parse_amount
+from services.ts_clients.ts_client import DEFAULT_ACCOUNT, TrafficSourceClient
+
+_CSRF_EXTRACTOR = HtmlExtractor(
+    xpath='//*[@id="login-form"]/input[@type="hidden"]/@value',
+    pattern=r'id="login-form".*?<input(?=[^>]*type="hidden")[^>]*value="([^"]*)"',
+)
+# "#topnav > div.topbar-main > div > div.menu-extras > div.top-nav.pull-right.hidden-xs > ul > li:nth-child(3) > a"
+_BALANCE_EXTRACTOR = HtmlExtractor(
+    xpath=f'//*[@id="topnav"]/div{has_class("topbar-main")}/div/div{has_class("menu-extras")}'
+          f'/div{has_class("top-nav")}{has_class("pull-right")}{has_class("hidden-xs")}/ul/*[3][self::li]/a',
+    pattern=r'id="topnav".*?class="[^"]*\btop-nav\b[^"]*".*?<ul\b(?:.*?<li\b){3}[^>]*>\s*<a\b[^>]*>([^<]*)',
+)
 
 
 class DaoPushClient(TrafficSourceClient):
-    def __init__(self, telegram_access_token):
+    def __init__(self, telegram_access_token, account=None):
+        account = account or {"name": DEFAULT_ACCOUNT, "login": os.getenv("DAO_EMAIL"),
+                              "password": os.getenv("DAO_PASSWORD")}
+
         super().__init__(
             telegram_access_token=telegram_access_token,
             network_fullname="DaoPush",
             network_alias="dao",
             interface="web",
-            login=os.getenv("DAO_EMAIL"),
-            password=os.getenv("DAO_PASSWORD"))
+            account_name=account["name"],
+            login=account["login"],
+            password=account["password"])
 
     def _authorize(self):
         """
@@ -35,7 +50,7 @@ class DaoPushClient(TrafficSourceClient):
         """
 
         self._update_user_agent()
-        session = requests.Session()
+        session = requests_manager.new_session()
 
         main_page = requests_manager.get(
             session,
@@ -70,15 +85,10 @@ class DaoPushClient(TrafficSourceClient):
                                f"Response: {auth_page.text}")
             return False
 
-        soup = BeautifulSoup(auth_page.text, "lxml")
+        csrf = _CSRF_EXTRACTOR.extract(auth_page.text)
 
-        try:
-            csrf = str(soup.select("#login-form > input[type=hidden]")[0]).split('value="')[1].split('"')[0]
-        except IndexError:
-            self._logger.error("IndexError occurred while trying to get csrf-token from dao.ad login-page.")
-            return False
-        except ValueError:
-            self._logger.error("ValueError occurred while trying to get csrf-token from dao.ad login-page.")
+        if csrf is None:
+            self._logger.error("Can't get csrf-token from dao.ad login-page.")
             return False
 
         time.sleep(5)
@@ -110,6 +120,19 @@ class DaoPushClient(TrafficSourceClient):
 
         return True
 
+    def _session_is_alive(self):
+        """
+        Liveness probe: request statistics page without redirects (site redirects to login page if session is invalid).
+
+        :return: True if alive, False if invalidated, None if it can't be checked
+        :rtype: Union[None, bool]
+        """
+
+        probe_response = requests_manager.get(self._session, "https://dao.ad/manage/statistic", allow_redirects=False,
+                                              stream=True)
+
+        return self._parse_probe_response(probe_response)
+
     def get_balance(self):
         """
         Get DaoPush balance.
@@ -117,9 +140,8 @@ class DaoPushClient(TrafficSourceClient):
         :rtype: Union[None, float]
         """
 
-        if not self._session_is_active():
-            if not self._authorize():
-                return
+        if not self._ensure_session():
+            return
 
         statistics_page = requests_manager.get(self._session, "https://dao.ad/manage/statistic")
 
@@ -131,18 +153,12 @@ class DaoPushClient(TrafficSourceClient):
                                f"Response: {statistics_page.text}")
             return
 
-        soup = BeautifulSoup(statistics_page.text, "lxml")
-        try:
-            balance = float(
-                str(
-                    soup.select(
-                        "#topnav > div.topbar-main > div > div.menu-extras > div.top-nav.pull-right.hidden-xs > ul > "
-                        "li:nth-child(3) > a"
-                    )[0]
-                ).split('$')[1].split('<')[0]
-            )
-        except (IndexError, ValueError):
+        balance = parse_amount(_BALANCE_EXTRACTOR.extract(statistics_page.text))
+
+        if balance is None:
             self._logger.error("Can't get balance from dao.ad statistics page.")
+            self._mark_session_alive(False)
             return
 
+        self._mark_session_alive(True)
         return balance
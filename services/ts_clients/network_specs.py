@@ -0,0 +1,140 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+"""
+Registry of supported networks. Networks are described in json file (NETWORK_SPECS_FILE, default networks.json near
+this module). Api-interface networks are fully declarative and are executed by ApiClient:
+
+    name           network fullname (as in database)
+    alias          network alias for bot commands
+    interface      "api"
+    class_name     client class name (optional, used in logs and <CLASS NAME>_CONCURRENCY variable)
+    url            balance request url, may contain credentials placeholders (e.g. {client_id})
+    auth           {"scheme": "bearer"}, {"scheme": "header", "header": <name>} or {"scheme": "query", "param": <name>}
+    credentials    account field -> environment variable with default account value (access_token is required)
+    headers        request headers (optional)
+    params         request query params (optional)
+    balance_path   path to balance in response json, e.g. "data.advertiser", "items[0].balance" or "$" (whole json)
+    bulk           multi-account (agency) endpoint which returns balances of many accounts in one request (optional):
+                   url, credentials (agency token and url placeholders, bulk request is made only if they are set),
+                   items_path (list of accounts), item_id_path (account id in item), account_field (account field
+                   with the same id) and balance_path (balance in item); auth scheme and headers are the same.
+                   Add it only for endpoint checked against real agency account: none of networks has it now,
+                   so accounts are fetched one by one
+    rate_limit     max requests per second for all network accounts (optional, 0 - unlimited)
+    pool_size      max number of keep-alive connections to network (optional)
+
+Web-interface networks need login flow, so they are implemented in code: "client_class" is dotted path to the class.
+"""
+
+import json
+import os
+import re
+from functools import reduce
+from operator import getitem
+
+NETWORK_SPECS_FILE = os.getenv("NETWORK_SPECS_FILE",
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), "networks.json"))
+
+_AUTH_SCHEMES = {"bearer": (), "header": ("header",), "query": ("param",)}
+_JSON_PATH_TOKEN = re.compile(r"[^.\[\]]+|\[\d+\]")
+
+
+def compile_json_path(path):
+    """
+    Compile path to value in decoded json (dot separated keys and [index] items, "$" or "" - whole json).
+
+    :param path: path
+    :type path: str
+
+    :return: function which returns value by path (raises KeyError, IndexError or TypeError if path doesn't exist)
+    :rtype: Callable[[Any], Any]
+    """
+
+    keys = tuple(
+        int(token[1:-1]) if token.startswith("[") else token
+        for token in _JSON_PATH_TOKEN.findall(path[1:] if path.startswith("$") else path)
+    )
+
+    def get(document):
+        return reduce(getitem, keys, document)
+
+    return get
+
+
+def _validate(spec):
+    """
+    Check that network spec is correct.
+
+    :param spec: network spec
+    :type spec: Dict[str, Any]
+
+    :return: None
+    """
+
+    for key in ("name", "alias", "interface"):
+        if key not in spec:
+            raise ValueError(f"Network spec {spec} has no {key}.")
+
+    if spec["interface"] == "web":
+        if "client_class" not in spec:
+            raise ValueError(f"Web-interface network {spec['name']} has no client_class.")
+        return
+
+    if spec["interface"] != "api":
+        raise ValueError(f"Incorrect interface of network {spec['name']}: {spec['interface']}.")
+
+    for key in ("url", "auth", "credentials", "balance_path"):
+        if key not in spec:
+            raise ValueError(f"Api-interface network {spec['name']} has no {key}.")
+
+    if "access_token" not in spec["credentials"]:
+        raise ValueError(f"Network {spec['name']} credentials have no access_token.")
+
+    scheme = spec["auth"].get("scheme")
+    if scheme not in _AUTH_SCHEMES:
+        raise ValueError(f"Incorrect auth scheme of network {spec['name']}: {scheme}.")
+
+    for key in _AUTH_SCHEMES[scheme]:
+        if key not in spec["auth"]:
+            raise ValueError(f"Auth scheme {scheme} of network {spec['name']} requires {key}.")
+
+    if "bulk" in spec:
+        for key in ("url", "credentials", "items_path", "item_id_path", "account_field", "balance_path"):
+            if key not in spec["bulk"]:
+                raise ValueError(f"Bulk endpoint of network {spec['name']} has no {key}.")
+
+        if "access_token" not in spec["bulk"]["credentials"]:
+            raise ValueError(f"Bulk endpoint credentials of network {spec['name']} have no access_token.")
+
+
+def load_specs(path=NETWORK_SPECS_FILE):
+    """
+    Load and validate network specs.
+
+    :param path: specs file path
+    :type path: str
+
+    :return: network specs (in file order)
+    :rtype: List[Dict[str, Any]]
+    """
+
+    with open(path, "r", encoding="utf-8") as specs_file:
+        specs = json.load(specs_file)
+
+    for spec in specs:
+        _validate(spec)
+
+    if len({spec["alias"] for spec in specs}) != len(specs) or len({spec["name"] for spec in specs}) != len(specs):
+        raise ValueError("Network names and aliases must be unique.")
+
+    return specs
+
+
+NETWORK_SPECS = load_specs()
+NETWORK_ALIASES = {spec["alias"]: spec["name"] for spec in NETWORK_SPECS}  # alias -> fullname
@@ -10,25 +10,39 @@ import os
 from datetime import datetime
 
 import requests
-from bs4 import BeautifulSoup
 
 from services.helpers import requests_manager
-from services.helpers.captcha_solver import CaptchaSolver
-from services.ts_clients.ts_client import TrafficSourceClient
+from services.helpers.captcha_service import CaptchaService
+from services.helpers.html_extractor import HtmlExtractor, has_class, parse_amount
+from services.ts_clients.ts_client import DEFAULT_ACCOUNT, TrafficSourceClient
+
+_SITEKEY_EXTRACTOR = HtmlExtractor(
+    xpath='//*[@id="mainBlock"]/div/form//*[@data-sitekey]/@data-sitekey',
+    pattern=r'data-sitekey="([^"]+)"',
+)
+# "body > div.wrapper100.headerblock > div > div > div.col.flexible > div > div.amountBlock > span"
+_BALANCE_EXTRACTOR = HtmlExtractor(
+    xpath=f'/html/body/div{has_class("wrapper100")}{has_class("headerblock")}/div/div'
+          f'/div{has_class("col")}{has_class("flexible")}/div/div{has_class("amountBlock")}/span',
+    pattern=r'class="[^"]*\bamountBlock\b[^"]*"[^>]*>.*?<span\b[^>]*>([^<]*)',
+)
 
 
 class PushHouseClient(TrafficSourceClient):
-    def __init__(self, telegram_access_token):
-        self._captcha_solver = CaptchaSolver()
-        self._now_authorizing = False
+    def __init__(self, telegram_access_token, account=None):
+        account = account or {"name": DEFAULT_ACCOUNT, "login": os.getenv("PUSHHOUSE_EMAIL"),
+                              "password": os.getenv("PUSHHOUSE_PASSWORD")}
+
+        self._captcha_service = CaptchaService()
 
         super().__init__(
             telegram_access_token=telegram_access_token,
             network_fullname="Push.house",
             network_alias="pushhouse",
             interface="web",
-            login=os.getenv("PUSHHOUSE_EMAIL"),
-            password=os.getenv("PUSHHOUSE_PASSWORD"))
+            account_name=account["name"],
+            login=account["login"],
+            password=account["password"])
 
     def _authorize(self):
         """
@@ -38,13 +52,9 @@ class PushHouseClient(TrafficSourceClient):
         :rtype: bool
         """
 
-        if self._now_authorizing:
-            return "Now authorizing."
-
-        self._now_authorizing = True
         self._update_user_agent()
 
-        session = requests.Session()
+        session = requests_manager.new_session()
 
         auth_page = requests_manager.get(
             session,
@@ -61,19 +71,16 @@ class PushHouseClient(TrafficSourceClient):
                                f"Response: {auth_page.text}")
             return False
 
-        soup = BeautifulSoup(auth_page.text, "lxml")
+        data_sitekey = _SITEKEY_EXTRACTOR.extract(auth_page.text)
 
-        try:
-            data_sitekey = str(soup.select("#mainBlock > div > form > div:nth-child(4) > div")[0]).split('"')[3]
-        except IndexError:
+        if data_sitekey is None:
             self._logger.error("Can't get data-sitekey (captcha key) from pushhouse auth page.")
             return False
 
-        g_recaptcha_response = self._captcha_solver.solve(data_sitekey, "https://push.house/auth/login")
+        g_recaptcha_response = self._captcha_service.get_token(data_sitekey, "https://push.house/auth/login")
 
-        if g_recaptcha_response == 0:
+        if not g_recaptcha_response:
             self._logger.error("Captcha solving error.")
-            self._now_authorizing = False
             return False
 
         auth_data = {
@@ -109,11 +116,23 @@ class PushHouseClient(TrafficSourceClient):
 
         self._session = session
         self._session_ctime = datetime.utcnow()
-        self._now_authorizing = False
 
         super()._authorize()
         return True
 
+    def _session_is_alive(self):
+        """
+        Liveness probe: request dashboard without redirects (site redirects to login page if session is invalid).
+
+        :return: True if alive, False if invalidated, None if it can't be checked
+        :rtype: Union[None, bool]
+        """
+
+        probe_response = requests_manager.get(self._session, "https://push.house/dashboard", allow_redirects=False,
+                                              stream=True)
+
+        return self._parse_probe_response(probe_response)
+
     def get_balance(self):
         """
         Get Push.house balance.
@@ -122,12 +141,8 @@ class PushHouseClient(TrafficSourceClient):
         :rtype: Union[None, float]
         """
 
-        if not self._session_is_active():
-            authorization_status = self._authorize()
-            if not authorization_status:
-                return
-            elif authorization_status == "Now authorizing.":
-                return authorization_status
+        if not self._ensure_session():
+            return
 
         dashboard_response = requests_manager.get(
             self._session, "https://push.house/dashboard"
@@ -143,19 +158,12 @@ class PushHouseClient(TrafficSourceClient):
             )
             return
 
-        soup_page = BeautifulSoup(dashboard_response.text, "lxml")
+        balance = parse_amount(_BALANCE_EXTRACTOR.extract(dashboard_response.text))
 
-        try:
-            balance = float(
-                str(
-                    soup_page.select(
-                        "body > div.wrapper100.headerblock > div > div > "
-                        "div.col.flexible > div > div.amountBlock > span"
-                    )[0]
-                ).split("$")[1].split("<")[0].strip()
-            )
-        except (IndexError, ValueError):
+        if balance is None:
             self._logger.error("Can't get balance from dashboard-page.")
+            self._mark_session_alive(False)
             return
 
+        self._mark_session_alive(True)
         return balance
@@ -6,29 +6,61 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
+import json
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
 from random import choice
 
+import requests
+
+from services.balance_history import BalanceHistory
 from services.database_cursor import Database
+from services.helpers import metrics, requests_manager
+from services.helpers.burn_rate import BurnRateEstimator
+from services.helpers.session_store import SessionStore
 from services.telegram.sender import Sender
 
 
+DEFAULT_ACCOUNT = "default"
+
+BALANCE_FETCH_DURATION = metrics.histogram("balance_fetch_duration_seconds", "Duration of balance fetching.",
+                                           ("network",))
+BALANCE_FETCHES = metrics.counter("balance_fetches", "Balance fetches by result (success, failure).",
+                                  ("network", "result"))
+AUTHORIZATIONS = metrics.counter("web_authorizations", "Web-interface authorizations by result (success, failure).",
+                                 ("network", "result"))
+
+
 class TrafficSourceClient:
-    def __init__(self, telegram_access_token, network_fullname, network_alias, interface, **kwargs):
-        self._logger = logging.getLogger(f"WorkingLoop.BalanceService.{network_fullname}Client")
+    def __init__(self, telegram_access_token, network_fullname, network_alias, interface,
+                 account_name=DEFAULT_ACCOUNT, **kwargs):
+        logger_name = f"WorkingLoop.BalanceService.{network_fullname}Client"
+        if account_name != DEFAULT_ACCOUNT:
+            logger_name += f".{account_name}"
+
+        self._logger = logging.getLogger(logger_name)
         self._sender = Sender(telegram_access_token)
 
         self._last_notification_level = None
         self._last_notification_sending_time = None
         self._database = Database()
+        self._balance_history = BalanceHistory()
         self.network_fullname = network_fullname
         self.network_alias = network_alias
+        self.account_name = account_name
         self.interface = interface
 
         self.notifications_interval = float(os.getenv("NOTIFICATIONS_INTERVAL", 2))  # hours
 
+        self._burn_rate = BurnRateEstimator(half_life=float(os.getenv("FORECAST_HALF_LIFE", 6)))  # hours
+        self._forecast_horizon = float(os.getenv("FORECAST_HORIZON", 24))  # hours
+        self._last_forecast_sending_time = None
+        self.hours_until_critical = None
+
         if interface == "api":
             if "access_token" in kwargs:
                 self._access_token = kwargs["access_token"]
@@ -39,8 +71,20 @@ class TrafficSourceClient:
 
         elif interface == "web":
             self._session_lifetime = float(os.getenv("SESSION_LIFETIME", 2))  # hours
+            self._session_probe_interval = float(os.getenv("SESSION_PROBE_INTERVAL", 600))  # seconds
+            self._session_renewal_lead = float(os.getenv("SESSION_RENEWAL_LEAD", 300))  # seconds
+            self._session_lifetime_alpha = float(os.getenv("SESSION_LIFETIME_ALPHA", 0.3))
+            self._session_lifetime_growth = float(os.getenv("SESSION_LIFETIME_GROWTH", 1.5))
+            self._learned_session_lifetime = None  # seconds, EWMA of observed sessions lifetime
+            self._session_renewal_timer = None
             self._session = None
             self._session_ctime = None
+            self._session_check_time = None
+            self._session_store = SessionStore()
+
+            self._authorization_lock = threading.Lock()
+            self._authorizations_count = 0
+            self._last_authorization_status = False
 
             if "login" in kwargs:
                 self._login = kwargs["login"]
@@ -57,10 +101,38 @@ class TrafficSourceClient:
                 exit(-1)
 
             self._read_user_agents()
+            self._restore_session()
         else:
             self._logger.error(f"Incorrect network interface: {interface}")
             exit(-1)
 
+    @property
+    def display_name(self):
+        """
+        Network fullname with account name (account name is omitted for default account).
+
+        :return: display name
+        :rtype: str
+        """
+
+        if self.account_name == DEFAULT_ACCOUNT:
+            return self.network_fullname
+
+        return f"{self.network_fullname} ({self.account_name})"
+
+    def has_credentials(self):
+        """
+        Check that all credentials required by client interface are set.
+
+        :return: True if credentials are set, else False
+        :rtype: bool
+        """
+
+        if self.interface == "api":
+            return bool(self._access_token)
+
+        return bool(self._login and self._password)
+
     def _read_user_agents(self):
         with open("user_agents.csv", "r", encoding="utf-8") as user_agents_file:
             self._user_agents_list = user_agents_file.read().split("\n")
@@ -74,22 +146,419 @@ class TrafficSourceClient:
 
         self._user_agent = choice(self._user_agents_list)
 
+    @property
+    def _session_name(self):
+        return f"{self.network_fullname}:{self.account_name}"
+
+    def _restore_session(self):
+        """
+        Restore session saved in session store (if exists).
+
+        :return: None
+        """
+
+        stored_session = self._session_store.load(self._session_name)
+
+        if not stored_session:
+            return
+
+        cookies, self._session_ctime, self._user_agent = stored_session
+
+        self._session = requests_manager.new_session()
+        self._session.cookies.update(cookies)
+
+        self._logger.info(f"Session restored (created at {self._session_ctime.isoformat()} UTC).")
+        self._schedule_session_renewal()
+
     def _authorize(self):
-        pass
+        """
+        Save authorized session to session store. Subclasses call it after successful authorization.
+
+        :return: None
+        """
+
+        self._session_check_time = time.monotonic()
+        self._session_store.save(self._session_name, self._session.cookies, self._session_ctime, self._user_agent)
+        self._schedule_session_renewal()
+
+    def _learn_session_lifetime(self):
+        """
+        Update learned session lifetime with lifetime of just invalidated session.
+
+        :return: None
+        """
+
+        lifetime = (datetime.utcnow() - self._session_ctime).total_seconds()
+
+        if self._learned_session_lifetime is None:
+            self._learned_session_lifetime = lifetime
+        else:
+            self._learned_session_lifetime += self._session_lifetime_alpha * (lifetime - self._learned_session_lifetime)
+
+        self._logger.info(f"Session lived {lifetime / 3600:.2f} hours, "
+                          f"learned lifetime: {self._learned_session_lifetime / 3600:.2f} hours.")
+
+    def _extend_session_lifetime(self):
+        """
+        Extend predicted lifetime if session is still alive near its predicted expiry (sessions aren't replaced while
+        they are alive, so short prediction is corrected by probes instead of invalidations).
+
+        :return: None
+        """
+
+        age = (datetime.utcnow() - self._session_ctime).total_seconds()
+        predicted_lifetime = self.predicted_session_lifetime()
+
+        if age < predicted_lifetime - self._session_renewal_time_lead():
+            return
+
+        self._learned_session_lifetime = max(age, predicted_lifetime) * self._session_lifetime_growth
+
+        self._logger.info(f"Session is alive after {age / 3600:.2f} hours, "
+                          f"predicted lifetime extended to {self._learned_session_lifetime / 3600:.2f} hours.")
+        self._schedule_session_renewal()
+
+    def predicted_session_lifetime(self):
+        """
+        Predicted session lifetime: learned from invalidated sessions or configured session lifetime.
+
+        :return: lifetime in seconds
+        :rtype: float
+        """
+
+        if self._learned_session_lifetime is not None:
+            return self._learned_session_lifetime
+
+        return self._session_lifetime * 3600
+
+    def _session_renewal_time_lead(self):
+        """
+        How long before predicted session expiry the renewal starts.
+
+        :return: lead in seconds
+        :rtype: float
+        """
+
+        return self._session_renewal_lead
+
+    def _schedule_session_renewal(self):
+        """
+        Start timer which checks session in background shortly before its predicted expiry, so invalidated session is
+        replaced before balance checks need it.
+
+        :return: None
+        """
+
+        if self._session_renewal_timer:
+            self._session_renewal_timer.cancel()
+
+        expiry_time = self._session_ctime + timedelta(seconds=self.predicted_session_lifetime())
+        delay = (expiry_time - datetime.utcnow()).total_seconds() - self._session_renewal_time_lead()
+
+        # session which is about to expire is checked by the next balance check
+        if delay <= 0:
+            return
+
+        self._session_renewal_timer = threading.Timer(delay, self._renew_session)
+        self._session_renewal_timer.daemon = True
+        self._session_renewal_timer.name = f"SessionRenewalTimer-{self._session_name}"
+        self._session_renewal_timer.start()
+
+    def _renew_session(self):
+        """
+        Probe session near its predicted expiry - target method for session renewal timer. Alive session is kept (and
+        its predicted lifetime is extended), invalidated session is replaced by new authorization.
+
+        :return: None
+        """
+
+        self._logger.info("Check session before predicted expiry.")
+        self._session_check_time = None
+        self._ensure_session()
+
+    def _session_is_alive(self):
+        """
+        Liveness probe: check that site still accepts session. By default session is considered alive until session
+        lifetime expires; web clients override this with cheap request to page available only after authorization.
+
+        :return: True if alive, False if invalidated, None if it can't be checked (e.g. network error)
+        :rtype: Union[None, bool]
+        """
+
+        return datetime.utcnow() - self._session_ctime < timedelta(hours=self._session_lifetime)
+
+    def _parse_probe_response(self, probe_response):
+        """
+        Interpret liveness probe response (made without redirects): only redirect to login page or 401/403 means that
+        session is invalidated, other non-success responses (e.g. 5xx, 429) are treated as unknown.
+
+        :param probe_response: probe response or error
+        :type probe_response: Union[requests.Response, Exception]
+
+        :return: True if alive, False if invalidated, None if it can't be checked
+        :rtype: Union[None, bool]
+        """
+
+        if not isinstance(probe_response, requests.Response):
+            self._logger.warning(f"Can't check {self.display_name} session: {probe_response}")
+            return
+
+        probe_response.close()
+
+        if probe_response.status_code == 200:
+            return True
+
+        if probe_response.status_code in (401, 403):
+            return False
+
+        if probe_response.is_redirect and "login" in probe_response.headers.get("Location", "").lower():
+            return False
+
+        self._logger.warning(f"Can't check {self.display_name} session: get probe response with status code "
+                             f"{probe_response.status_code}.")
+
+    def _mark_session_alive(self, alive):
+        """
+        Save result of request made with session: successful request means that session is alive, failed one forces
+        liveness probe on next session check.
+
+        :param alive: True if request succeeded, else False
+        :type alive: bool
+
+        :return: None
+        """
+
+        self._session_check_time = time.monotonic() if alive else None
+
+    def _ensure_session(self):
+        """
+        Make sure that session is active and authorize if it isn't. Liveness probe, session invalidation and
+        authorization run under authorization lock, so probe can't drop session created by concurrent authorization.
+        Only one authorization runs at a time: concurrent callers wait for authorization in flight and get its result
+        instead of starting their own.
+
+        :return: True if session is active, else False
+        :rtype: bool
+        """
+
+        if self._session_is_fresh():
+            return True
+
+        authorizations_count = self._authorizations_count
+
+        with self._authorization_lock:
+            if self._authorizations_count != authorizations_count:
+                return self._last_authorization_status
+
+            if self._session_is_active():
+                return True
+
+            try:
+                self._last_authorization_status = bool(self._authorize())
+            except Exception as error:
+                self._logger.error(f"Error occurred while trying to authorize: {error!r}")
+                self._last_authorization_status = False
+
+            self._authorizations_count += 1
+            AUTHORIZATIONS.inc(network=self.network_fullname,
+                               result="success" if self._last_authorization_status else "failure")
+
+            return self._last_authorization_status
+
+    def _session_is_fresh(self):
+        """
+        Checks that session exists and was checked for session probe interval (no liveness probe is needed).
+
+        :return: True if fresh, else False
+        :rtype: bool
+        """
+
+        return bool(
+            self.interface == "web" and self._session and self._session_check_time and
+            time.monotonic() - self._session_check_time < self._session_probe_interval
+        )
 
     def _session_is_active(self):
         """
-        Checks that session is alive (age less than session lifetime).
+        Checks that session exists and is alive. Liveness probe is made only if session isn't fresh. Must be called
+        under authorization lock.
 
         :return: True if alive, else False
         :rtype: bool
         """
 
-        if self.interface == "web":
-            return self._session and datetime.utcnow() - self._session_ctime < timedelta(hours=self._session_lifetime)
+        if self.interface != "web" or not self._session:
+            return False
+
+        if self._session_is_fresh():
+            return True
+
+        alive = self._session_is_alive()
+
+        if alive is False:
+            self._logger.info("Session was invalidated, authorization required.")
+            self._learn_session_lifetime()
+            self._session = None
+            self._session_check_time = None
+            self._session_store.delete(self._session_name)
+            return False
+
+        if alive:
+            self._session_check_time = time.monotonic()
+            self._extend_session_lifetime()
+
+        return True
+
+    def _balance_request(self):
+        """
+        Return url and request kwargs for balance request (api-interface only).
+
+        :return: url and kwargs for GET-request
+        :rtype: Tuple[str, dict]
+        """
+
+        raise NotImplementedError
+
+    def _parse_balance_response(self, balance_response):
+        """
+        Extract balance from balance response (api-interface only).
+
+        :param balance_response: response with status_code, text and json() (sync or async)
+        :type balance_response: Union[requests.Response, services.helpers.async_requests_manager.Response]
+
+        :return: balance or None
+        :rtype: Union[None, float]
+        """
+
+        raise NotImplementedError
 
     def get_balance(self):
-        pass
+        """
+        Get balance. Web-interface clients override this method, api-interface clients describe balance request
+        and response parsing using _balance_request and _parse_balance_response.
+
+        :return: balance or None
+        :rtype: Union[None, float]
+        """
+
+        if self.interface != "api":
+            return
+
+        url, request_kwargs = self._balance_request()
+        balance_response = requests_manager.get(None, url, **request_kwargs)
+
+        if not isinstance(balance_response, requests.Response):
+            self._logger.error(f"Error occurred while trying to get {self.display_name} balance: {balance_response}")
+            return
+
+        return self._parse_balance_response(balance_response)
+
+    def record_balance_fetch(self, duration, balance):
+        """
+        Record balance fetch metrics.
+
+        :param duration: fetch duration in seconds
+        :type duration: float
+
+        :param balance: fetched balance (None if fetching failed)
+        :type balance: Union[None, float]
+
+        :return: None
+        """
+
+        BALANCE_FETCH_DURATION.observe(duration, network=self.network_fullname)
+        BALANCE_FETCHES.inc(network=self.network_fullname, result="failure" if balance is None else "success")
+
+    def fetch_balance(self):
+        """
+        Get balance and record fetch metrics.
+
+        :return: balance or None
+        :rtype: Union[None, float]
+        """
+
+        start_time = time.perf_counter()
+        balance = None
+
+        try:
+            balance = self.get_balance()
+        finally:
+            self.record_balance_fetch(time.perf_counter() - start_time, balance)
+
+        return balance
+
+    def _batch_key(self):
+        """
+        Return key identifying balance request of this account. Accounts with equal keys share one request.
+
+        :return: batch key
+        :rtype: str
+        """
+
+        if self.interface == "api":
+            url, request_kwargs = self._balance_request()
+            return json.dumps([url, request_kwargs], sort_keys=True, default=str)
+
+        return json.dumps(["web", self._login])
+
+    @classmethod
+    def _get_balances_batch(cls, clients):
+        """
+        Get balances of given accounts using bulk endpoint. Networks with multi-account endpoints override this method,
+        accounts missing in result are fetched one by one.
+
+        :param clients: clients (accounts) of this class
+        :type clients: List[TrafficSourceClient]
+
+        :return: balances of accounts fetched in bulk
+        :rtype: Dict[TrafficSourceClient, Union[None, float]]
+        """
+
+        return {}
+
+    @classmethod
+    def get_balances(cls, clients, max_workers=1):
+        """
+        Get balances of given accounts. Bulk endpoint is used first (if network has it), the rest of accounts are
+        fetched concurrently; accounts with identical balance request share one request.
+
+        :param clients: clients (accounts) of this class
+        :type clients: List[TrafficSourceClient]
+
+        :param max_workers: max number of simultaneous single requests
+        :type max_workers: int
+
+        :return: balances of accounts (None if balance can't be fetched)
+        :rtype: Dict[TrafficSourceClient, Union[None, float]]
+        """
+
+        start_time = time.perf_counter()
+        balances = cls._get_balances_batch(clients)
+
+        for client, balance in balances.items():
+            client.record_balance_fetch(time.perf_counter() - start_time, balance)
+
+        requests_groups = {}
+        for client in clients:
+            if client not in balances:
+                requests_groups.setdefault(client._batch_key(), []).append(client)
+
+        if not requests_groups:
+            return balances
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(requests_groups))) as executor:
+            futures = [(executor.submit(group[0].fetch_balance), group) for group in requests_groups.values()]
+
+        for future, group in futures:
+            error = future.exception()
+
+            if error:
+                group[0]._logger.error(f"Error occurred while trying to get {group[0].display_name} balance: {error!r}")
+
+            for client in group:
+                balances[client] = None if error else future.result()
+
+        return balances
 
     def send_status_message(self, balance, level):
         """
@@ -104,23 +573,85 @@ class TrafficSourceClient:
         :return: None
         """
 
-        message = f"<b>{level.upper()}</b>: {self.network_fullname} balance is {balance}$"
-        success, users_list = self._database.get_users()
-
-        if not success:
-            self._logger.error(f"Database error occurred while trying to get users: {users_list}")
-            return
+        message = f"<b>{level.upper()}</b>: {self.display_name} balance is {balance}$"
 
         if not self._last_notification_sending_time or \
                 datetime.utcnow() - self._last_notification_sending_time >= timedelta(
             hours=self.notifications_interval):
 
-            for user in users_list:
-                self._sender.send_message(user["chat_id"], message)
+            if not self._send_to_all_users(message):
+                return
 
             self._last_notification_level = level
             self._last_notification_sending_time = datetime.utcnow()
 
+    def _send_to_all_users(self, message):
+        """
+        Queue message to all users from database (alerts don't wait for sending and can be coalesced).
+
+        :param message: message text
+        :type message: str
+
+        :return: True if message is queued, else False
+        :rtype: bool
+        """
+
+        success, users_list = self._database.get_users()
+
+        if not success:
+            self._logger.error(f"Database error occurred while trying to get users: {users_list}")
+            return False
+
+        for user in users_list:
+            self._sender.send_message_async(user["chat_id"], message, coalesce=True)
+
+        return True
+
+    def check_forecast(self, balance, critical_balance):
+        """
+        Update spend rate estimation and send notification if projected time until critical level is less than
+        forecast horizon (balance already below critical level is handled by static levels).
+
+        :param balance: balance
+        :type balance: float
+
+        :param critical_balance: critical-level border
+        :type critical_balance: float
+
+        :return: None
+        """
+
+        self._burn_rate.update(time.time(), balance)
+        self.hours_until_critical = self._burn_rate.hours_until(balance, critical_balance)
+
+        if self.hours_until_critical is None or balance <= critical_balance:
+            return
+
+        if self.hours_until_critical >= self._forecast_horizon:
+            return
+
+        if self._last_forecast_sending_time and \
+                datetime.utcnow() - self._last_forecast_sending_time < timedelta(hours=self.notifications_interval):
+            return
+
+        message = (f"<b>FORECAST</b>: {self.display_name} balance is {balance}$, spend rate is "
+                   f"{round(self._burn_rate.rate, 2)}$/h. Critical level ({critical_balance}$) in "
+                   f"~{round(self.hours_until_critical, 1)} h, "
+                   f"zero in ~{round(self._burn_rate.hours_until(balance, 0), 1)} h.")
+
+        if self._send_to_all_users(message):
+            self._last_forecast_sending_time = datetime.utcnow()
+
+    def is_enabled(self):
+        """
+        Check that network isn't disabled.
+
+        :return: True if enabled, else False
+        :rtype: bool
+        """
+
+        return self._database.get_network_status(self.network_fullname) != "disabled"
+
     def check_balance(self):
         """
         Check balance and send notification if necessary.
@@ -128,18 +659,26 @@ class TrafficSourceClient:
         :return: None
         """
 
-        status = self._database.get_network_status(self.network_fullname)
-        if status == "disabled":
+        if not self.is_enabled():
             return
 
-        balance = self.get_balance()
+        self.handle_balance(self.fetch_balance())
+
+    def handle_balance(self, balance):
+        """
+        Compare fetched balance with notification levels and send notification if necessary.
+
+        :param balance: fetched balance (None if fetching failed)
+        :type balance: Union[None, float]
+
+        :return: None
+        """
 
         if balance is None:
             self._logger.error("Can't get balance.")
             return
 
-        if isinstance(balance, str):
-            return
+        self._balance_history.add_sample(self.network_fullname, self.account_name, balance)
 
         success, notification_levels = self._database.get_notification_levels(self.network_fullname)
 
@@ -147,6 +686,8 @@ class TrafficSourceClient:
             self._logger.error(f"Can't get notification levels from database: {notification_levels}")
             return
 
+        self.check_forecast(balance, notification_levels["critical"])
+
         notification_level = None
         last_balance = 10 ** 9  # just very big number
 
@@ -7,10 +7,18 @@
 # Author: German Yakimov <german13yakimov@gmail.com>
 
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from datetime import datetime
 
+from services.balance_history import BalanceHistory, DAY, HOUR
 from services.balance_service import BalanceService
 from services.database_cursor import Database
+from services.telegram.dispatcher import MAX_MESSAGE_LENGTH
 from services.telegram.sender import Sender
+from services.ts_clients.network_specs import NETWORK_ALIASES
+from services.ts_clients.ts_client import DEFAULT_ACCOUNT
 
 
 class UpdateHandler:
@@ -24,6 +32,7 @@ class UpdateHandler:
         self._sender = Sender(telegram_access_token)
         self._database = Database()
         self._balance_service = BalanceService(telegram_access_token)
+        self._balance_history = BalanceHistory()
 
         self._available_commands = [
             "/set_info_balance",
@@ -33,14 +42,21 @@ class UpdateHandler:
             "/set_notifications_interval",
             "/disable",
             "/enable",
+            "/history",
             "/start",
             "/help",
         ]
 
-        self._available_networks = ["dao", "eva", "prop", "zero", "mgid", "pushhouse"]
+        self._available_networks = list(NETWORK_ALIASES)
         self._available_notification_levels = ["info", "warning", "critical"]
         self._help_message = self._read_help_message()
 
+        self._get_balance_deadline = float(os.getenv("GET_BALANCE_DEADLINE", 15))  # seconds
+        self._get_balance_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("GET_BALANCE_WORKERS", 2 * len(self._available_networks))),
+            thread_name_prefix="GetBalanceWorker",
+        )
+
         self._logger.info("UpdateHandler was successfully initialized.")
 
     @staticmethod
@@ -78,22 +94,7 @@ class UpdateHandler:
         :rtype: str
         """
 
-        if alias == "prop":
-            return "PropellerAds"
-        elif alias == "eva":
-            return "Evadav"
-        elif alias == "pushhouse":
-            return "Push.house"
-        elif alias == "dao":
-            return "DaoPush"
-        elif alias == "zero":
-            return "ZeroPark"
-        elif alias == "mgid":
-            return "MGID"
-        elif alias == "kadam":
-            return "Kadam"
-
-        return "Unknown"
+        return NETWORK_ALIASES.get(alias, "Unknown")
 
     @staticmethod
     def is_command(update):
@@ -150,7 +151,12 @@ class UpdateHandler:
             self._sender.send_message(chat_id, "I support only commands. Use /help for details.")
             return False
 
-        if not self._database.is_authorized(chat_id):
+        success, authorized = self._database.is_authorized(chat_id)
+
+        if not success:
+            self._logger.error(f"Database error occurred while trying to check user authorization: {authorized}")
+
+        if not success or not authorized:
             self._logger.warning(f"Message from unauthorized user: {update}")
             self._sender.send_message(chat_id, "Permission denied.")
             return False
@@ -191,12 +197,11 @@ class UpdateHandler:
             self._set_balance_value(chat_id, level, *args)
 
         elif command == "/get_balance":
-            if not args:
-                self._get_balance(chat_id, "")
-            elif len(args) == 1:
-                self._get_balance(chat_id, args[0])
+            if len(args) <= 2:
+                self._get_balance(chat_id, *args)
             else:
-                self._sender.send_message(chat_id, f"Invalid number of arguments (expected 0 or 1, got {len(args)}).")
+                self._sender.send_message(chat_id,
+                                          f"Invalid number of arguments (expected 0, 1 or 2, got {len(args)}).")
 
         elif command == "/set_notifications_interval":
             if not args:
@@ -228,6 +233,14 @@ class UpdateHandler:
             else:
                 self._sender.send_message(chat_id, f"Invalid number of arguments (expected 1, got {len(args)}).")
 
+        elif command == "/history":
+            if not args:
+                self._sender.send_message(chat_id, "Please specify network.")
+            elif len(args) <= 2:
+                self._history(chat_id, *args)
+            else:
+                self._sender.send_message(chat_id, f"Invalid number of arguments (expected 1 or 2, got {len(args)}).")
+
     def balance_is_valid(self, network, level, balance_to_set):
         """
         Check that given border-balance for given network and notification level is valid (can be set without errors).
@@ -312,41 +325,206 @@ class UpdateHandler:
         self._database.set_notification_level_balance(self._network_alias_to_name(network), level, balance)
         self._sender.send_message(chat_id, "Success.")
 
-    def _get_balance(self, chat_id, network_alias):
+    @staticmethod
+    def _message_chunks(lines):
+        """
+        Split message lines into chunks which fit telegram message length limit (too long lines are truncated).
+
+        :param lines: message lines
+        :type lines: List[str]
+
+        :return: chunks of lines (one chunk per message)
+        :rtype: List[List[str]]
+        """
+
+        chunks = [[]]
+        length = 0
+
+        for line in lines:
+            if len(line) > MAX_MESSAGE_LENGTH:
+                line = f"{line[:MAX_MESSAGE_LENGTH - 3]}..."
+
+            if chunks[-1] and length + 1 + len(line) > MAX_MESSAGE_LENGTH:
+                chunks.append([])
+                length = 0
+
+            length += len(line) + (1 if len(chunks[-1]) else 0)
+            chunks[-1].append(line)
+
+        return chunks
+
+    def _network_balance_lines(self, network_alias, max_staleness=None):
+        """
+        Get balances of all accounts of given network and format them.
+
+        :param network_alias: network alias
+        :type network_alias: str
+
+        :param max_staleness: max age of cached balances in seconds (None - default cache ttl)
+        :type max_staleness: Union[None, float]
+
+        :return: lines with balances (one line per account)
+        :rtype: List[str]
+        """
+
+        balances = self._balance_service.get_balance(network_alias, max_staleness)
+
+        if not balances:
+            return [f"There are no accounts for {self._network_alias_to_name(network_alias)}."]
+
+        lines = []
+
+        for client, balance in balances:
+            if balance is not None:
+                lines.append(f"<b>{client.display_name}</b> balance is {balance}$")
+            else:
+                lines.append(f"Sorry, something went wrong with {client.display_name}. "
+                             f"Try again later or/and contact developers.")
+
+        return lines
+
+    def _future_balance_lines(self, future, network_alias):
+        """
+        Get result of _network_balance_lines from finished future.
+
+        :param future: finished future
+        :type future: concurrent.futures.Future
+
+        :param network_alias: network alias
+        :type network_alias: str
+
+        :return: lines with balances
+        :rtype: List[str]
+        """
+
+        error = future.exception()
+
+        if error:
+            self._logger.error(f"Error occurred while trying to get {network_alias} balance: {error!r}")
+            return [f"Sorry, something went wrong with {self._network_alias_to_name(network_alias)}. "
+                    f"Try again later or/and contact developers."]
+
+        return future.result()
+
+    def _pending_networks_block(self, pending_networks):
+        """
+        Compose block of pending networks (it is kept in one message).
+
+        :param pending_networks: aliases of networks which balances are not received yet
+        :type pending_networks: List[str]
+
+        :return: block lines (empty if there are no pending networks)
+        :rtype: List[str]
+        """
+
+        if not pending_networks:
+            return []
+
+        return ["\n".join(f"<b>{self._network_alias_to_name(network)}</b>: pending..." for network in pending_networks)]
+
+    def _get_all_balances(self, chat_id, max_staleness=None):
+        """
+        Fetch balances of all networks concurrently and send one aggregated message. Networks which missed
+        deadline are marked as pending and message is edited when their balances are received. If lines don't fit
+        telegram message length limit, filled message is left as is and the rest lines are sent in new message.
+
+        :param chat_id: sender chat id
+        :type chat_id: int
+
+        :param max_staleness: max age of cached balances in seconds (None - default cache ttl)
+        :type max_staleness: Union[None, float]
+
+        :return: None
+        """
+
+        futures = {
+            self._get_balance_executor.submit(self._network_balance_lines, network, max_staleness): network
+            for network in self._available_networks
+        }
+
+        lines = []
+        pending_networks = list(self._available_networks)
+        lock = threading.Lock()
+
+        message_id = None
+        first_line = 0  # first line of last (editable) message, previous lines are in filled messages
+
+        def publish():
+            nonlocal message_id, first_line
+
+            chunks = self._message_chunks(lines[first_line:] + self._pending_networks_block(pending_networks))
+
+            for number, chunk in enumerate(chunks):
+                if number == 0 and message_id is not None:
+                    self._sender.edit_message(chat_id, message_id, "\n".join(chunk))
+                else:
+                    message_id = self._sender.send_message(chat_id, "\n".join(chunk))
+
+                # pending networks block is the last one, so all chunks but the last contain received lines only
+                if number < len(chunks) - 1:
+                    first_line += len(chunk)
+
+        try:
+            for future in as_completed(futures, timeout=self._get_balance_deadline):
+                lines.extend(self._future_balance_lines(future, futures[future]))
+                pending_networks.remove(futures[future])
+        except TimeoutError:
+            self._logger.warning(f"Balances of {pending_networks} weren't received in {self._get_balance_deadline} "
+                                 f"seconds, mark them as pending.")
+
+        publish()
+
+        if not pending_networks or message_id is None:
+            return
+
+        def update_message(finished_future):
+            with lock:
+                lines.extend(self._future_balance_lines(finished_future, futures[finished_future]))
+                pending_networks.remove(futures[finished_future])
+
+                publish()
+
+        for future, network in futures.items():
+            if network in pending_networks:
+                future.add_done_callback(update_message)
+
+    def _get_balance(self, chat_id, network_alias="all", max_staleness=None):
         """
         Handle /get_balance command.
 
         :param chat_id: sender chat id
         :type chat_id: int
 
-        :param network_alias: network alias
+        :param network_alias: network alias ("all" - all networks)
         :type network_alias: str
 
+        :param max_staleness: max age of cached balances in seconds (None - default cache ttl)
+        :type max_staleness: Union[None, str]
+
         :return: None
         """
 
-        if network_alias and network_alias not in self._available_networks:
+        if network_alias != "all" and network_alias not in self._available_networks:
             self._sender.send_message(chat_id, "Incorrect network. Use /help to get list of supported networks.")
             return
 
-        if not network_alias:
-            for network in self._available_networks:
-                self._get_balance(chat_id, network)
-            return
+        if max_staleness is not None:
+            try:
+                max_staleness = float(max_staleness)
+            except ValueError:
+                self._sender.send_message(chat_id, "Incorrect max staleness (not a number).")
+                return
 
-        balance = self._balance_service.get_balance(network_alias)
-        network_name = self._network_alias_to_name(network_alias)
+            if max_staleness < 0:
+                self._sender.send_message(chat_id, "Max staleness can't be negative.")
+                return
 
-        if balance == "Now authorizing.":
-            self._sender.send_message(chat_id,
-                                      f"Trying to solve CAPTCHA for Push.house authorization. Please, try again later.")
+        if network_alias == "all":
+            self._get_all_balances(chat_id, max_staleness)
             return
 
-        if balance:
-            self._sender.send_message(chat_id, f"<b>{network_name}</b> balance is {balance}$")
-        else:
-            self._sender.send_message(chat_id,
-                                      "Sorry, something went wrong. Try again later or/and contact developers.")
+        for chunk in self._message_chunks(self._network_balance_lines(network_alias, max_staleness)):
+            self._sender.send_message(chat_id, "\n".join(chunk))
 
     def _set_notifications_interval(self, chat_id, interval):
         """
@@ -405,6 +583,89 @@ class UpdateHandler:
         self._database.set_network_status("enabled", self._network_alias_to_name(network_alias))
         self._sender.send_message(chat_id, "Success.")
 
+    @staticmethod
+    def _parse_period(period):
+        """
+        Convert period like 12h, 7d or 4w to seconds.
+
+        :param period: period
+        :type period: str
+
+        :return: period in seconds or None if period is incorrect
+        :rtype: Union[None, float]
+        """
+
+        units = {"h": HOUR, "d": DAY, "w": 7 * DAY}
+
+        try:
+            value = float(period[:-1])
+        except ValueError:
+            return
+
+        if period[-1:] not in units or value <= 0:
+            return
+
+        return value * units[period[-1]]
+
+    def _history(self, chat_id, network_alias, period="7d"):
+        """
+        Handle /history command: send balance history of network accounts for given period (from rollups).
+
+        :param chat_id: sender chat id
+        :type chat_id: int
+
+        :param network_alias: network alias
+        :type network_alias: str
+
+        :param period: period like 12h, 7d or 4w
+        :type period: str
+
+        :return: None
+        """
+
+        if network_alias not in self._available_networks:
+            self._sender.send_message(chat_id, "Incorrect network. Use /help to get list of supported networks.")
+            return
+
+        period_seconds = self._parse_period(period)
+
+        if not period_seconds:
+            self._sender.send_message(chat_id, "Incorrect period (examples: 12h, 7d, 4w).")
+            return
+
+        network_name = self._network_alias_to_name(network_alias)
+        success, resolution, history = self._balance_history.get_history(network_name, period_seconds)
+
+        if not success:
+            self._logger.error(f"Database error occurred while trying to get balance history: {history}")
+            self._sender.send_message(chat_id,
+                                      "Sorry, something went wrong. Try again later or/and contact developers.")
+            return
+
+        if not history:
+            self._sender.send_message(chat_id, f"There is no {network_name} balance history for {period}.")
+            return
+
+        time_format = "%Y-%m-%d %H:00" if resolution == HOUR else "%Y-%m-%d"
+        lines = []
+
+        for account, rollups in history.items():
+            title = network_name if account == DEFAULT_ACCOUNT else f"{network_name} ({account})"
+            first, last = rollups[0], rollups[-1]
+
+            lines.append(f"<b>{title}</b> for {period}: {round(last['last'], 2)}$ "
+                         f"(min {round(min(rollup['minimum'] for rollup in rollups), 2)}$, "
+                         f"max {round(max(rollup['maximum'] for rollup in rollups), 2)}$, "
+                         f"change {round(last['last'] - first['average'], 2)}$)")
+
+            for rollup in rollups[-12:]:
+                bucket_time = datetime.utcfromtimestamp(rollup["bucket"]).strftime(time_format)
+                lines.append(f"{bucket_time}: {round(rollup['average'], 2)}$ "
+                             f"({round(rollup['minimum'], 2)}$ - {round(rollup['maximum'], 2)}$)")
+
+        for chunk in self._message_chunks(lines):
+            self._sender.send_message(chat_id, "\n".join(chunk))
+
     def _start(self, chat_id):
         """
         Send greeting to user.
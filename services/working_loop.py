@@ -6,16 +6,30 @@
 # Proprietary and confidential
 # Author: German Yakimov <german13yakimov@gmail.com>
 
+import asyncio
 import logging
 import os
 import platform
+import secrets
 import threading
-import time
 from queue import Queue
+from urllib.parse import urlsplit
 
 from services.balance_service import BalanceService
+from services.helpers import log_pipeline, metrics
 from services.update_handler import UpdateHandler
 from services.telegram.updater import Updater
+from services.telegram.webhook import WebhookServer
+
+_STOP_HANDLING = object()  # sentinel which stops handling thread
+
+# read-only commands: repeated request in one batch gives the same answer, so it is handled once
+_DEDUPLICATED_COMMANDS = frozenset(("/get_balance", "/help"))
+
+_QUEUE_SIZE = metrics.gauge("updates_queue_size", "Number of update batches waiting in handling thread queue.",
+                            ("thread",))
+_HANDLING_DURATION = metrics.histogram("update_handling_duration_seconds", "Duration of update handling.")
+_HANDLING_ERRORS = metrics.counter("update_handling_errors", "Updates which handling failed with error.")
 
 
 class WorkingLoop:
@@ -41,27 +55,30 @@ class WorkingLoop:
         self._update_handler = UpdateHandler(telegram_access_token)
         self._balance_service = BalanceService(telegram_access_token)
 
-        self._lock = threading.Lock()
-        self._updates_queue = Queue()
+        self._balances_checking_mode = os.getenv("BALANCES_CHECKING_MODE", "threads")  # threads or asyncio
+        self._updates_mode = os.getenv("UPDATES_MODE", "polling")  # polling or webhook
+        self._polling_timeout = int(os.getenv("UPDATES_POLLING_TIMEOUT", 50))  # seconds
+
+        # updates from one chat always go to the same handling thread, so they are handled in order; every queue item is
+        # batch (list) of updates
+        self._handling_threads_number = int(os.getenv("HANDLING_THREADS", 4))
+        self._updates_queues = [Queue() for _ in range(self._handling_threads_number)]
+        self._handling_threads = []
+
+        for number, updates_queue in enumerate(self._updates_queues):
+            _QUEUE_SIZE.set_function(updates_queue.qsize, thread=number)
 
         self._logger.info("WorkingLoop was successfully initialized.")
 
     def _configure_logger(self):
         """
-        Set logger basic configuration.
+        Set logger basic configuration (see log_pipeline for LOG_* settings).
         """
 
-        self._logger.setLevel(logging.DEBUG)
-
-        file_handler = logging.FileHandler("log.log", "w", "utf-8")
-        file_handler.setFormatter(
-            logging.Formatter(
-                fmt="%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-            )
-        )
-        file_handler.setLevel(logging.DEBUG)
-        self._logger.addHandler(file_handler)
+        log_pipeline.configure(self._logger, logging.DEBUG)
 
+        self._logger.info(f"Logging mode: {log_pipeline.LOG_MODE}, format: {log_pipeline.LOG_FORMAT}, "
+                          f"rotation: {log_pipeline.LOG_ROTATION}")
         self._logger.info(f"Platform: {platform.system().lower()}")
         self._logger.info(f"WD: {os.getcwd()}")
 
@@ -80,19 +97,13 @@ class WorkingLoop:
         errors = []
 
         required_files_list = ["user_agents.csv"]
+        # network credentials are optional: accounts can be defined in database (accounts table)
         required_env_variables_list = [
             "TELEGRAM_ACCESS_TOKEN",
-            "PROPELLER_ACCESS_TOKEN",
-            "EVADAV_ACCESS_TOKEN",
-            "PUSHHOUSE_EMAIL",
-            "PUSHHOUSE_PASSWORD",
-            "DAO_EMAIL",
-            "DAO_PASSWORD",
-            "CAPTCHA_SERVICE_KEY",
-            "ZEROPARK_ACCESS_TOKEN",
-            "MGID_CLIENT_ID",
-            "MGID_ACCESS_TOKEN",
         ]
+        # fake captcha backend (for tests) doesn't need solving service key
+        if os.getenv("CAPTCHA_BACKEND", "anticaptcha") == "anticaptcha":
+            required_env_variables_list.append("CAPTCHA_SERVICE_KEY")
 
         for file in required_files_list:
             if not os.path.exists(file):
@@ -111,31 +122,157 @@ class WorkingLoop:
         Method for infinite updates listening - target method for main thread.
         """
 
+        # updates can't be received by long polling while webhook is set (e.g. after webhook mode run)
+        self._updater.delete_webhook()
+
         offset = None
 
         while True:
-            updates_list = self._updater.get_updates(offset)
+            updates_list = self._updater.get_updates(offset, timeout=self._polling_timeout, limit=100)
+
+            if updates_list:
+                self._put_updates(updates_list)
+                offset = updates_list[-1]["update_id"] + 1
+
+    def _start_webhook(self):
+        """
+        Start webhook server and set webhook.
+
+        :return: webhook server if success, else None
+        :rtype: Union[None, WebhookServer]
+        """
+
+        webhook_url = os.getenv("WEBHOOK_URL")  # public https url which telegram pushes updates to
+
+        if not webhook_url:
+            self._logger.error("Can't find WEBHOOK_URL environment variable.")
+            return
+
+        try:
+            webhook_server = WebhookServer(
+                self._put_update,
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", 8443)),
+                # path can differ from public url path if server is behind reverse proxy
+                path=os.getenv("WEBHOOK_PATH", urlsplit(webhook_url).path or "/"),
+                secret_token=os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32),
+            )
+        except (OSError, ValueError) as error:
+            self._logger.error(f"Can't start webhook server: {error!r}")
+            return
+
+        if not self._updater.set_webhook(webhook_url, webhook_server.secret_token):
+            webhook_server.close()
+            return
+
+        return webhook_server
+
+    def _start_metrics_server(self):
+        """
+        Start metrics server if metrics port is set.
+
+        :return: None
+        """
+
+        metrics_port = int(os.getenv("METRICS_PORT", 0))  # 0 - metrics aren't served
+
+        if not metrics_port:
+            return
+
+        try:
+            metrics.MetricsServer(os.getenv("METRICS_HOST", "127.0.0.1"), metrics_port).start()
+        except OSError as error:
+            self._logger.error(f"Can't start metrics server: {error!r}")
+
+    def _put_update(self, update):
+        """
+        Put single update (e.g. received by webhook) to queue of handling thread selected by chat id.
+
+        :param update: update
+        :type update: dict
+
+        :return: None
+        """
+
+        self._put_updates([update])
+
+    def _put_updates(self, updates):
+        """
+        Split updates batch between handling threads (by chat id) and put every part to its queue in one operation.
+        Repeated read-only commands from the same chat (e.g. several taps on get balance button) are handled once if
+        there is no other command between them; commands which change state are never skipped.
+
+        :param updates: updates
+        :type updates: List[dict]
+
+        :return: None
+        """
+
+        batches = {}
+        seen_messages = {}  # chat id -> read-only commands since last other command of chat
 
-            for update in updates_list:
-                with self._lock:
-                    self._updates_queue.put(update)
+        for update in updates:
+            chat_id = self._update_handler.extract_chat_id(update)
+            text = update.get("message", {}).get("text")
 
-                offset = update["update_id"] + 1
+            if text is not None:
+                chat_messages = seen_messages.setdefault(chat_id, set())
+                command = " ".join(text.split())
 
-    def _handle_updates(self):
+                if command.split(" ")[0] not in _DEDUPLICATED_COMMANDS:
+                    chat_messages.clear()
+                elif command in chat_messages:
+                    self._logger.debug(f"Skip repeated message from {chat_id}: {text}")
+                    continue
+                else:
+                    chat_messages.add(command)
+
+            batches.setdefault(hash(chat_id) % self._handling_threads_number, []).append(update)
+
+        for queue_number, batch in batches.items():
+            self._updates_queues[queue_number].put(batch)
+
+    def _handle_updates(self, updates_queue):
         """
-        Method for infinite updates handling - target method for HandlingThread.
+        Method for updates handling until stop sentinel - target method for HandlingThread.
+
+        :param updates_queue: queue of this handling thread
+        :type updates_queue: Queue
         """
 
         while True:
-            if not self._updates_queue.empty():
-                with self._lock:
-                    update = self._updates_queue.get()
-            else:
-                time.sleep(2)
-                continue
+            batch = updates_queue.get()
+
+            if batch is _STOP_HANDLING:
+                return
 
-            self._update_handler.handle_command(update)
+            for update in batch:
+                try:
+                    with _HANDLING_DURATION.time():
+                        self._update_handler.handle_command(update)
+                except Exception as error:
+                    _HANDLING_ERRORS.inc()
+                    self._logger.error(f"Error occurred while handling update {update}: {error!r}")
+
+    def stop(self):
+        """
+        Stop handling threads after they handle already received updates.
+        """
+
+        for updates_queue in self._updates_queues:
+            updates_queue.put(_STOP_HANDLING)
+
+        for handling_thread in self._handling_threads:
+            handling_thread.join()
+
+        self._logger.info("Updates handling stopped.")
+
+    def _check_balances_async(self):
+        """
+        Run balances checking in asyncio event loop - target method for BalancesCheckingThread in asyncio mode.
+        """
+
+        asyncio.run(self._balance_service.check_balances_async())
 
     def start(self):
         """
@@ -145,16 +282,40 @@ class WorkingLoop:
 
         self._logger.info("WorkingLoop started.")
 
-        handling_thread = threading.Thread(target=self._handle_updates, daemon=True, name="HandlingThread")
+        self._start_metrics_server()
+
+        if self._balances_checking_mode == "asyncio":
+            balances_checking_target = self._check_balances_async
+        else:
+            balances_checking_target = self._balance_service.check_balances
+
+        self._handling_threads = [
+            threading.Thread(target=self._handle_updates, args=(updates_queue,), daemon=True,
+                             name=f"HandlingThread-{number}")
+            for number, updates_queue in enumerate(self._updates_queues)
+        ]
         balances_check_thread = threading.Thread(
-            target=self._balance_service.check_balances, daemon=True, name="BalancesCheckingThread"
+            target=balances_checking_target, daemon=True, name="BalancesCheckingThread"
         )
         threading.current_thread().name = "ListeningThread"
 
-        handling_thread.start()
+        for handling_thread in self._handling_threads:
+            handling_thread.start()
         balances_check_thread.start()
 
-        self._logger.info("Start handling updates and balances checking.")
+        self._logger.info(f"Start handling updates and balances checking ({self._balances_checking_mode} mode).")
+
+        webhook_server = self._start_webhook() if self._updates_mode == "webhook" else None
+
+        try:
+            if webhook_server:
+                self._logger.info("Start receiving updates by webhook.")
+                webhook_server.serve_forever()
+            else:
+                if self._updates_mode == "webhook":
+                    self._logger.warning("Can't use webhook, fall back to long polling.")
 
-        self._logger.info("Start listening for updates.")
-        self._listen_for_updates()
+                self._logger.info("Start listening for updates.")
+                self._listen_for_updates()
+        finally:
+            self.stop()
@@ -0,0 +1,104 @@
+# Copyright © 2020-2021 Filthy Claws Tools - All Rights Reserved
+#
+# This file is part of balance-bot project.
+#
+# Unauthorized copying of this file, via any medium is strictly prohibited
+# Proprietary and confidential
+# Author: German Yakimov <german13yakimov@gmail.com>
+
+"""
+Fake telegram: push bot command updates to local webhook server like telegram does.
+
+Usage: python tools/fake_telegram_poster.py --url http://127.0.0.1:8443/telegram --secret <WEBHOOK_SECRET>
+                                             --chat-id 12345 --text "/get_balance prop" --count 3
+"""
+
+import argparse
+import itertools
+import json
+import time
+import urllib.error
+import urllib.request
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def make_update(update_id, chat_id, text):
+    """
+    Create update with text message (bot command if text starts with "/").
+
+    :param update_id: update id
+    :type update_id: int
+
+    :param chat_id: sender chat id
+    :type chat_id: int
+
+    :param text: message text
+    :type text: str
+
+    :return: update
+    :rtype: dict
+    """
+
+    message = {
+        "message_id": update_id,
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Fake"},
+        "chat": {"id": chat_id, "type": "private"},
+        "date": int(time.time()),
+        "text": text,
+    }
+
+    if text.startswith("/"):
+        message["entities"] = [{"offset": 0, "length": len(text.split()[0]), "type": "bot_command"}]
+
+    return {"update_id": update_id, "message": message}
+
+
+def post_update(url, secret, update):
+    """
+    Post update to webhook server.
+
+    :param url: webhook url
+    :type url: str
+
+    :param secret: webhook secret token
+    :type secret: str
+
+    :param update: update
+    :type update: dict
+
+    :return: response status code
+    :rtype: int
+    """
+
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={"Content-Type": "application/json", SECRET_TOKEN_HEADER: secret},
+        method="POST",
+    )
+
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post fake telegram updates to local webhook server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/", help="webhook url")
+    parser.add_argument("--secret", required=True, help="webhook secret token (WEBHOOK_SECRET)")
+    parser.add_argument("--chat-id", type=int, required=True, help="sender chat id (must be in users table)")
+    parser.add_argument("--text", default="/start", help="message text")
+    parser.add_argument("--count", type=int, default=1, help="number of updates")
+    parser.add_argument("--first-update-id", type=int, default=int(time.time()), help="id of first update")
+    args = parser.parse_args()
+
+    for update_id in itertools.islice(itertools.count(args.first_update_id), args.count):
+        status_code = post_update(args.url, args.secret, make_update(update_id, args.chat_id, args.text))
+        print(f"update {update_id}: {status_code}")
+
+
+if __name__ == "__main__":
+    main()